@@ -1,24 +1,36 @@
 # admin_bot.py
 import asyncio
+import json
+import time
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import db
-from config import ADMIN_BOT_TOKEN, USER_BOT_USERNAME, ADMIN_IDS
-from utils import export_report_to_excel
-import os
+import async_db
+import metrics
+from fsm_storage import SQLiteStorage
+import logging
+from config import ADMIN_BOT_TOKEN, USER_BOT_USERNAME, ADMIN_IDS, MAX_CONCURRENT_UPDATES, TELEGRAM_API_URL
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL
+from cache import LRUCache
+from cutoffs import CutoffScheduler
+from live_reports import LiveReports
+from render import bill_blocks, edit_message, overview_blocks, paginate, remember
+from utils import export_report_to_excel, parse_cutoff, parse_menu_csv, parse_menu_text, parse_menu_xlsx
 
 import asyncio
-import sqlite3
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-bot = Bot(token=ADMIN_BOT_TOKEN)
-dp = Dispatcher()
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=ADMIN_BOT_TOKEN, session=session)
+storage = SQLiteStorage()
+dp = Dispatcher(storage=storage)
+metrics.install(dp, "admin")
 
 # ------------------------------
 # FSM states for creating order and menu
@@ -55,7 +67,7 @@ async def process_order_title(message: Message, state: FSMContext):
     title = message.text.strip()
     if not title:
         return await message.answer("❌ Title cannot be empty.")
-    order_id = db.create_order(title, message.from_user.id)
+    order_id = await async_db.create_order(title, message.from_user.id)
 
     # لینک دعوت به UserBot
     link = f"https://t.me/{USER_BOT_USERNAME}?start={order_id}"
@@ -76,17 +88,66 @@ async def start_add_menu(message: Message, state: FSMContext):
         return await message.answer("⛔ Not authorized.")
     order_id = int(message.text.split("_")[1])
     await state.update_data(order_id=order_id)
-    await message.answer("📌 Please send the name of the menu item:")
+    await message.answer(
+        "📌 Please send the name of the menu item.\n"
+        "To add many at once, paste one \"name - price\" per line or upload a CSV/XLSX file "
+        "(name and price columns)."
+    )
     await state.set_state(MenuStates.waiting_for_item_name)
 
+# ------------------------------
+# Bulk menu import: pasted lines or a CSV/XLSX file
+# ------------------------------
+MAX_IMPORT_BYTES = 5 * 1024 * 1024
+MAX_REPORTED_ERRORS = 20
+
+@dp.message(MenuStates.waiting_for_item_name, F.document)
+async def process_menu_file(message: Message, state: FSMContext):
+    document = message.document
+    filename = (document.file_name or "").lower()
+    if filename.endswith(".csv"):
+        parser = parse_menu_csv
+    elif filename.endswith(".xlsx"):
+        parser = parse_menu_xlsx
+    else:
+        return await message.answer("❌ Please upload a .csv or .xlsx file.")
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        return await message.answer("❌ File is too large (max 5 MB).")
+
+    data = await bot.download(document)
+    try:
+        items, errors = await asyncio.to_thread(parser, data.getvalue())
+    except Exception:
+        return await message.answer("❌ Could not read this file.")
+    await import_menu(message, state, items, errors)
+
+async def import_menu(message, state, items, errors):
+    data = await state.get_data()
+    if items:
+        # همه‌ی آیتم‌ها با یک تراکنش
+        await async_db.add_menus(data["order_id"], items)
+
+    lines = [f"✅ Imported {len(items)} items."]
+    if errors:
+        lines.append(f"⚠️ Skipped {len(errors)} rows:")
+        for number, raw, reason in errors[:MAX_REPORTED_ERRORS]:
+            lines.append(f"  {number}: {raw[:60]} ({reason})")
+        if len(errors) > MAX_REPORTED_ERRORS:
+            lines.append(f"  ... and {len(errors) - MAX_REPORTED_ERRORS} more")
+    lines.append("Send more items or type /done to finish.")
+    await message.answer("\n".join(lines))
+
 @dp.message(MenuStates.waiting_for_item_name)
 async def process_item_name(message: Message, state: FSMContext):
-    name = message.text.strip()
+    name = (message.text or "").strip()
     if name.lower() == "/done":
         await message.answer("✅ Finished adding menu items.")
         return await state.clear()
     if not name:
         return await message.answer("❌ Name cannot be empty.")
+    if "\n" in name:
+        items, errors = parse_menu_text(name)
+        return await import_menu(message, state, items, errors)
     await state.update_data(item_name=name)
     await message.answer("💰 Now send the price of this item:")
     await state.set_state(MenuStates.waiting_for_item_price)
@@ -100,7 +161,7 @@ async def process_item_price(message: Message, state: FSMContext):
         price = int(message.text.strip())
     except ValueError:
         return await message.answer("❌ Price must be a number.")
-    db.add_menu(order_id, name, price)
+    await async_db.add_menu(order_id, name, price)
     await message.answer(f"✅ Added {name} ({price} تومان). Send another item name or type /done to finish.")
     await state.set_state(MenuStates.waiting_for_item_name)
 
@@ -114,146 +175,286 @@ async def process_item_price(message: Message, state: FSMContext):
 async def report_handler(message: Message):
     if message.from_user.id not in ADMIN_IDS:
         return await message.answer("⛔ Not authorized.")
-    
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title FROM orders_table")
-    orders = cursor.fetchall()
-    conn.close()
-    
+
+    # /report <title prefix> فیلتر بر اساس ابتدای عنوان
+    parts = message.text.split(" ", 1)
+    prefix = parts[1].strip() if len(parts) > 1 else None
+    orders, has_older, has_newer = await async_db.get_orders_page(prefix=prefix)
+
     if not orders:
         return await message.answer("📭 No orders yet.")
-    
+
+    kb = order_list_markup(orders, has_older, has_newer, prefix)
+    sent = await message.answer("📋 Select an order to view:", reply_markup=kb)
+    remember(sent, "📋 Select an order to view:", kb)
+
+def order_list_markup(orders, has_older, has_newer, prefix=None):
     builder = InlineKeyboardBuilder()
     for order_id, title in orders:
         builder.button(text=f"{title}", callback_data=f"order_{order_id}")
     builder.adjust(1)
-    
-    await message.answer("📋 Select an order to view:", reply_markup=builder.as_markup())
+
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton(text="⬅️ Newer", callback_data=order_page_data("after", orders[0][0], prefix)))
+    if has_older:
+        nav.append(InlineKeyboardButton(text="Older ➡️", callback_data=order_page_data("before", orders[-1][0], prefix)))
+    if nav:
+        builder.row(*nav)
+    return builder.as_markup()
+
+def order_page_data(direction, order_id, prefix):
+    data = f"olist_{direction}_{order_id}_"
+    # callback_data حداکثر ۶۴ بایت است
+    room = 64 - len(data.encode())
+    return data + (prefix or "").encode()[:room].decode(errors="ignore")
+
+# ------------------------------
+# Callback: older / newer orders
+# ------------------------------
+@dp.callback_query(F.data.startswith("olist_"))
+async def order_page_callback(callback: CallbackQuery):
+    _, direction, order_id, prefix = callback.data.split("_", 3)
+    if direction == "before":
+        page = await async_db.get_orders_page(before_id=int(order_id), prefix=prefix)
+    else:
+        page = await async_db.get_orders_page(after_id=int(order_id), prefix=prefix)
+    if not page[0]:
+        page = await async_db.get_orders_page(prefix=prefix)
+
+    await edit_message(callback.message, "📋 Select an order to view:", reply_markup=order_list_markup(*page, prefix))
+    await callback.answer()
 
 # ------------------------------
 # Callback: show order menu
 # ------------------------------
-@dp.callback_query(F.data.startswith("order_"))
-async def order_menu_callback(callback: CallbackQuery):
-    _, order_id = callback.data.split("_")
-    order_id = int(order_id)
-    
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT title FROM orders_table WHERE id = ?", (order_id,))
-    title_row = cursor.fetchone()
-    order_title = title_row[0] if title_row else "Menu"
-    conn.close()
-    
-    text = f"📋 *{order_title}*"
+async def order_menu(order_id):
+    """
+    (text, keyboard) of an order's admin menu.
+    """
+    entry = await async_db.get_order_menu(order_id)
+    text = f"📋 *{entry.title or 'Menu'}*"
+    if entry.status == "closed":
+        text += "\n🔒 Closed"
+    elif entry.closes_at:
+        text += f"\n⏰ Closes at {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.closes_at))}"
     
     builder = InlineKeyboardBuilder()
     builder.button(text="📝 Order Overview", callback_data=f"overview_{order_id}")
     builder.button(text="💰 Invoice / Bill", callback_data=f"bill_{order_id}")
+    if entry.status == "open":
+        builder.button(text="✅ Finalize All Carts", callback_data=f"finalize_{order_id}")
+        builder.button(text="🔒 Close Order", callback_data=f"close_{order_id}")
     builder.button(text="🔙 Back to Main", callback_data="back_main")
     builder.adjust(1)
+    return text, builder.as_markup()
+
+@dp.callback_query(F.data.startswith("order_"))
+async def order_menu_callback(callback: CallbackQuery):
+    _, order_id = callback.data.split("_")
+    text, markup = await order_menu(int(order_id))
     
-    await callback.message.edit_text(text, reply_markup=builder.as_markup())
+    leave_report(callback.message)
+    await edit_message(callback.message, text, reply_markup=markup)
     await callback.answer()
 
 # ------------------------------
-# Callback: Order Overview
+# Callback: Order Overview / Invoice, one page per message
 # ------------------------------
-@dp.callback_query(F.data.startswith("overview_"))
-async def overview_callback(callback: CallbackQuery):
-    _, order_id = callback.data.split("_")
-    order_id = int(order_id)
-
-    # گرفتن گزارش کامل با جزئیات هر کاربر و مجموع کل
-    report = db.get_cart_report_summary(order_id)
-    if not report["users"]:
-        return await callback.answer("📭 No orders yet.")
+# (chat_id, message_id, kind) -> pages that message was built from; page turns
+# reuse them, so boundaries do not move between taps. Opening the report from
+# the order menu and every live refresh build them again.
+report_messages = LRUCache(256)
+
+
+def leave_report(message):
+    """
+    The message stops showing a report: no more live edits, pages dropped.
+    """
+    live_reports.unwatch(message)
+    for kind in REPORT_TITLES:
+        report_messages.pop((message.chat.id, message.message_id, kind))
+
+REPORT_TITLES = {
+    "overview": "📝 *Order Overview*",
+    "bill": "💰 *Invoice / Bill*",
+}
+
+def report_pages(kind, report):
+    blocks = overview_blocks(report) if kind == "overview" else bill_blocks(report)
+    return paginate(REPORT_TITLES[kind], blocks)
+
+def report_page(kind, order_id, pages, page):
+    """
+    (text, keyboard, page) of one report page; page is clamped to the last one.
+    """
+    page = min(page or 0, len(pages) - 1)
 
-    text = f"📝 *Order Overview*\n\n"
-
-    # جزئیات هر کاربر
-    for user, items in report["users"].items():
-        text += f"👤 {user}:\n"
-        for item_name, qty in items.items():
-            text += f"   - {item_name}: {qty} \n"
-        text += "\n"
-
-    # مجموع کل آیتم‌ها
-    text += "📊 *Total per item:*\n"
-    for item_name, total_qty in report["totals"].items():
-        text += f"   - {item_name}: {total_qty} \n"
-
-    # دکمه‌ها
     builder = InlineKeyboardBuilder()
-    builder.button(text="🔙 Back to Order Menu", callback_data=f"order_{order_id}")
-    builder.adjust(1)
-
-    await callback.message.edit_text(text, reply_markup=builder.as_markup())
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"{kind}_{order_id}_{page - 1}"))
+    if page < len(pages) - 1:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"{kind}_{order_id}_{page + 1}"))
+    if nav:
+        builder.row(*nav)
+    builder.row(InlineKeyboardButton(text="🔙 Back to Order Menu", callback_data=f"order_{order_id}"))
+    return pages[page], builder.as_markup(), page
+
+@dp.callback_query(F.data.startswith("overview_") | F.data.startswith("bill_"))
+async def report_page_callback(callback: CallbackQuery):
+    parts = callback.data.split("_")
+    kind, order_id = parts[0], int(parts[1])
+    page = int(parts[2]) if len(parts) > 2 else None
+
+    entry = await async_db.get_order_menu(order_id)
+    if entry.status == "closed":
+        # سفارش بسته: صفحه‌های ذخیره‌شده، بدون محاسبه
+        pages = json.loads(await order_snapshot(order_id, kind))
+    else:
+        # دکمه از منوی سفارش: گزارش تازه؛ دکمه صفحه: همان صفحه‌های قبلی این پیام
+        key = (callback.message.chat.id, callback.message.message_id, kind)
+        pages = report_messages.get(key) if page is not None else None
+        if pages is None:
+            report = await async_db.get_cart_report_with_prices(order_id)
+            if not report["users"]:
+                return await callback.answer("📭 No orders yet.")
+            pages = report_pages(kind, report)
+            report_messages.set(key, pages)
+
+    text, markup, page = report_page(kind, order_id, pages, page)
+    await edit_message(callback.message, text, reply_markup=markup)
+    if entry.status == "open":
+        live_reports.watch(callback.message, kind, order_id, page)
     await callback.answer()
 
+async def refresh_live_report(sub):
+    report = await async_db.get_cart_report_with_prices(sub.order_id)
+    pages = report_pages(sub.kind, report)
+    report_messages.set((sub.message.chat.id, sub.message.message_id, sub.kind), pages)
+    text, markup, sub.page = report_page(sub.kind, sub.order_id, pages, sub.page)
+    await edit_message(sub.message, text, reply_markup=markup)
 
-# ------------------------------
-# Callback: Invoice / Bill
-# ------------------------------
-@dp.callback_query(F.data.startswith("bill_"))
-async def bill_callback(callback: CallbackQuery):
-    _, order_id = callback.data.split("_")
-    order_id = int(order_id)
-
-    # گرفتن گزارش با قیمت‌ها از تابع جدید
-    report = db.get_cart_report_with_prices(order_id)
-    if not report or not report["users"]:
-        return await callback.answer("📭 No orders yet.")
-
-    text = f"💰 *Invoice / Bill*\n\n"
-
-    # نمایش جزئیات هر کاربر
-    for user, items in report["users"].items():
-        text += f"👤 *{user}*\n"
-        user_total = 0  # مجموع قیمت سفارش‌های هر کاربر
-        for item_name, data in items.items():
-            qty = data["quantity"]
-            price = data["total_price"]
-            text += f"  - {item_name}: {qty}  --> {price} Toman\n"
-            user_total += price
-        text += f" \n ➤ Total for {user}: {user_total} Toman\n\n"
+# پیام‌های باز گزارش با تغییر سبدها خودکار به‌روز می‌شوند
+live_reports = LiveReports(refresh_live_report)
 
 
+# ------------------------------
+# Finalize every cart of an order
+# ------------------------------
+async def finalize_all(order_id):
+    users, items = await async_db.finalize_order(order_id)
+    if not items:
+        return "📭 No carts to finalize."
+    return f"✅ Finalized {items} items from {users} users. Use /export {order_id} to download."
+
+@dp.callback_query(F.data.startswith("finalize_"))
+async def finalize_callback(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        return await callback.answer("⛔ Not authorized.", show_alert=True)
+    order_id = int(callback.data.split("_")[1])
+    await callback.answer(await finalize_all(order_id), show_alert=True)
+
+@dp.message(F.text.startswith("/finalize"))
+async def finalize_handler(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return await message.answer("⛔ Not authorized.")
+    try:
+        _, order_id = message.text.split(" ", 1)
+        order_id = int(order_id)
+    except ValueError:
+        return await message.answer("❌ Format: /finalize order_id")
+    await message.answer(await finalize_all(order_id))
 
-    # جمع کل نهایی
-    text += f"\n💵 *Grand Total: {report['grand_total']} Toman*"
-
-    # دکمه بازگشت
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🔙 Back to Order Menu", callback_data=f"order_{order_id}")
-    builder.adjust(1)
-
-    await callback.message.edit_text(text, reply_markup=builder.as_markup())
-    await callback.answer()
-
-
+# ------------------------------
+# Order lifecycle: close now or at a cutoff, snapshots of closed orders
+# ------------------------------
+async def build_snapshots(order_id):
+    """
+    Render the overview and invoice pages and the XLSX of a closed order once and store them.
+    """
+    report = await async_db.get_report(order_id)
+    priced_report = await async_db.get_order_items_report(order_id)
+    snapshots = {kind: json.dumps(report_pages(kind, priced_report)).encode() for kind in REPORT_TITLES}
+    snapshots["xlsx"] = await asyncio.to_thread(export_report_to_excel, report, priced_report)
+    await async_db.save_order_snapshots(order_id, snapshots)
+    return snapshots
+
+async def order_snapshot(order_id, kind):
+    data = await async_db.get_order_snapshot(order_id, kind)
+    if data is None:
+        # closed but the snapshots were never written (e.g. a crash right after closing)
+        data = (await build_snapshots(order_id))[kind]
+    return data
+
+async def close_order(order_id):
+    cutoffs.cancel(order_id)
+    result = await async_db.close_order(order_id)
+    if result is None:
+        return "❌ Order not found or already closed."
+    await build_snapshots(order_id)
+    users, items = result
+    return f"🔒 Order {order_id} closed: {items} items from {users} users are final. Use /export {order_id} to download."
+
+async def close_at_cutoff(order_id):
+    logging.info("Cutoff reached: %s", await close_order(order_id))
+
+cutoffs = CutoffScheduler(close_at_cutoff)
+
+@dp.callback_query(F.data.startswith("close_"))
+async def close_callback(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        return await callback.answer("⛔ Not authorized.", show_alert=True)
+    order_id = int(callback.data.split("_")[1])
+    await callback.answer(await close_order(order_id), show_alert=True)
+    text, markup = await order_menu(order_id)
+    await edit_message(callback.message, text, reply_markup=markup)
+
+@dp.message(F.text.startswith("/close"))
+async def close_handler(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return await message.answer("⛔ Not authorized.")
+    # /close <id> همین حالا؛ /close <id> 18:30 یا /close <id> +90 در زمان مشخص
+    parts = message.text.split()
+    try:
+        order_id = int(parts[1])
+        closes_at = parse_cutoff(parts[2]) if len(parts) > 2 else None
+    except (IndexError, ValueError):
+        return await message.answer("❌ Format: /close order_id [HH:MM | +minutes]")
+    if closes_at is None:
+        return await message.answer(await close_order(order_id))
+
+    if not await async_db.set_order_cutoff(order_id, closes_at):
+        return await message.answer("❌ Order not found or already closed.")
+    cutoffs.schedule(order_id, closes_at)
+    await message.answer(f"⏰ Order {order_id} closes at {time.strftime('%Y-%m-%d %H:%M', time.localtime(closes_at))}.")
+
+@dp.message(F.text.startswith("/reopen"))
+async def reopen_handler(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return await message.answer("⛔ Not authorized.")
+    try:
+        _, order_id = message.text.split(" ", 1)
+        order_id = int(order_id)
+    except ValueError:
+        return await message.answer("❌ Format: /reopen order_id")
+    if not await async_db.reopen_order(order_id):
+        return await message.answer("❌ Order not found or not closed.")
+    await message.answer(f"🔓 Order {order_id} is open again.")
 
 # ------------------------------
 # Callback: Back to Main Menu
 # ------------------------------
 @dp.callback_query(F.data == "back_main")
 async def back_main_callback(callback: CallbackQuery):
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title FROM orders_table")
-    orders = cursor.fetchall()
-    conn.close()
+    leave_report(callback.message)
+    orders, has_older, has_newer = await async_db.get_orders_page()
     
     if not orders:
-        return await callback.message.edit_text("📭 No orders yet.")
-    
-    builder = InlineKeyboardBuilder()
-    for order_id, title in orders:
-        builder.button(text=f"{title}", callback_data=f"order_{order_id}")
-    builder.adjust(1)
+        return await edit_message(callback.message, "📭 No orders yet.")
     
-    await callback.message.edit_text("📋 Select an order to view:", reply_markup=builder.as_markup())
+    kb = order_list_markup(orders, has_older, has_newer)
+    await edit_message(callback.message, "📋 Select an order to view:", reply_markup=kb)
     await callback.answer()
 
 # ------------------------------
@@ -266,22 +467,89 @@ async def export_handler(message: Message):
     try:
         _, order_id = message.text.split(" ", 1)
         order_id = int(order_id)
-        report = db.get_report(order_id)
-        if not report:
-            return await message.answer("📭 No orders yet.")
-        filename = f"report_{order_id}.xlsx"
-        export_report_to_excel(report, filename)
-        await message.answer_document(open(filename, "rb"))
-        os.remove(filename)
-    except:
-        await message.answer("❌ Format: /export order_id")
+    except ValueError:
+        return await message.answer("❌ Format: /export order_id")
+
+    # سفارش بسته: همان فایلی که هنگام بستن ساخته شد
+    data = await async_db.get_order_snapshot(order_id, "xlsx")
+    if data is not None:
+        return await message.answer_document(BufferedInputFile(data, filename=f"report_{order_id}.xlsx"))
+
+    # فقط سفارش‌های نهایی‌شده (order_items)، نه سبدهای در حال تغییر
+    report = await async_db.get_report(order_id)
+    if report:
+        priced_report = await async_db.get_order_items_report(order_id)
+    else:
+        report, priced_report = await async_db.get_archived_report(order_id)
+    if not report:
+        return await message.answer(f"📭 Nothing finalized yet. Use /finalize {order_id} first.")
+
+    # ساخت فایل در حافظه و خارج از event loop
+    data = await asyncio.to_thread(export_report_to_excel, report, priced_report)
+    await message.answer_document(BufferedInputFile(data, filename=f"report_{order_id}.xlsx"))
+
+# ------------------------------
+# Archive old orders
+# ------------------------------
+def archived_text(archived):
+    if not archived:
+        return "📭 Nothing to archive."
+    return f"🗄 Archived {len(archived)} orders: {', '.join(map(str, archived))}. /export still works for them."
+
+@dp.message(F.text.startswith("/archive"))
+async def archive_handler(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return await message.answer("⛔ Not authorized.")
+    # /archive <id> ... برای سفارش‌های بسته؛ بدون شناسه: سفارش‌های قدیمی
+    try:
+        order_ids = [int(part) for part in message.text.split()[1:]]
+    except ValueError:
+        return await message.answer("❌ Format: /archive [order_id ...]")
+    if order_ids:
+        archived = await async_db.archive_orders(order_ids=order_ids)
+    elif ARCHIVE_AFTER_DAYS:
+        archived = await async_db.archive_orders(older_than_days=ARCHIVE_AFTER_DAYS)
+    else:
+        return await message.answer("❌ Format: /archive order_id ...")
+    await message.answer(archived_text(archived))
+
+async def archive_job():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        try:
+            archived = await async_db.archive_orders(older_than_days=ARCHIVE_AFTER_DAYS)
+            if archived:
+                logging.info("Archived orders %s", archived)
+        except Exception:
+            logging.exception("Archiving old orders failed")
+
+background_tasks = set()
 
 # ------------------------------
 # Main
 # ------------------------------
+@dp.startup()
+async def on_startup():
+    await async_db.init_db()
+    await storage.purge()
+    live_reports.start()
+    if ARCHIVE_AFTER_DAYS:
+        background_tasks.add(asyncio.create_task(archive_job()))
+    for order_id, closes_at in await async_db.get_order_cutoffs():
+        cutoffs.schedule(order_id, closes_at)
+
+@dp.shutdown()
+async def on_shutdown():
+    live_reports.stop()
+    await cutoffs.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await storage.close()
+
 async def main():
-    db.init_db()
-    await dp.start_polling(bot)
+    await dp.start_polling(bot, tasks_concurrency_limit=MAX_CONCURRENT_UPDATES)
 
 if __name__ == "__main__":
     print("Started AdminBot")
@@ -0,0 +1,150 @@
+"""
+Async counterpart of db.py.
+
+Every db function is exposed here as a coroutine so handlers can await it
+without stalling the event loop shared by both bots. Reads run on a small
+thread pool; writes go through a single writer thread, so they are
+serialized and never fight each other for the SQLite write lock.
+
+The functions below are the storage interface the bots use; DB_ENGINE picks
+the engine behind them: db.py (SQLite) or memory_db.py (plain dicts, called
+inline since there is no I/O to move off the loop).
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import memory_db
+from config import DB_ENGINE, DB_POOL_SIZE, REPORT_MAX_AGE
+
+engine = memory_db if DB_ENGINE == "memory" else db
+# how old a report read through here can be (memory_db does not cache them)
+report_max_age = 0 if engine is memory_db else REPORT_MAX_AGE
+
+# یک کانکشن از pool برای نویسنده می‌ماند
+_readers = ThreadPoolExecutor(max_workers=max(1, DB_POOL_SIZE - 1), thread_name_prefix="db-read")
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+
+# time writes spent queued behind other writes (the single-writer "lock")
+writer_stats = {"writes": 0, "wait_seconds": 0.0}
+
+
+def _wrap(executor, fn, stats=None):
+    def timed(queued, *args, **kwargs):
+        stats["writes"] += 1
+        stats["wait_seconds"] += time.perf_counter() - queued
+        return fn(*args, **kwargs)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if stats is None:
+            call = functools.partial(fn, *args, **kwargs)
+        else:
+            call = functools.partial(timed, time.perf_counter(), *args, **kwargs)
+        return await loop.run_in_executor(executor, call)
+    return wrapper
+
+
+def _inline(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def reader(fn):
+    if engine is memory_db:
+        return _inline(fn)
+    return _wrap(_readers, fn)
+
+
+def writer(fn):
+    if engine is memory_db:
+        return _inline(fn)
+    return _wrap(_writer, fn, writer_stats)
+
+
+# ------------------------------
+# Schema
+# ------------------------------
+init_db = writer(engine.init_db)
+
+# ------------------------------
+# Users
+# ------------------------------
+add_user = writer(engine.add_user)
+get_user = reader(engine.get_user)
+update_user_name = writer(engine.update_user_name)
+
+# ------------------------------
+# Orders and menus
+# ------------------------------
+create_order = writer(engine.create_order)
+get_order = reader(engine.get_order)
+get_orders_page = reader(engine.get_orders_page)
+add_menu = writer(engine.add_menu)
+add_menus = writer(engine.add_menus)
+get_menus = reader(engine.get_menus)
+get_order_menu = reader(engine.get_order_menu)
+get_menu_screen = reader(engine.get_menu_screen)
+get_item_screen = reader(engine.get_item_screen)
+
+# ------------------------------
+# Cart
+# ------------------------------
+update_cart = writer(engine.update_cart)
+set_cart_quantities = writer(engine.set_cart_quantities)
+get_cart = reader(engine.get_cart)
+get_cart_quantity = reader(engine.get_cart_quantity)
+clear_cart = writer(engine.clear_cart)
+
+# ------------------------------
+# FSM storage
+# ------------------------------
+load_fsm_state = reader(engine.load_fsm_state)
+save_fsm_states = writer(engine.save_fsm_states)
+purge_fsm_states = writer(engine.purge_fsm_states)
+
+# ------------------------------
+# Finalization and reports
+# ------------------------------
+add_order = writer(engine.add_order)
+finalize_cart = writer(engine.finalize_cart)
+finalize_order = writer(engine.finalize_order)
+get_report = reader(engine.get_report)
+get_cart_report_summary = reader(engine.get_cart_report_summary)
+get_cart_report_with_prices = reader(engine.get_cart_report_with_prices)
+get_order_items_report = reader(engine.get_order_items_report)
+
+# ------------------------------
+# Order lifecycle
+# ------------------------------
+OrderClosed = db.OrderClosed
+close_order = writer(engine.close_order)
+reopen_order = writer(engine.reopen_order)
+set_order_cutoff = writer(engine.set_order_cutoff)
+get_order_cutoffs = reader(engine.get_order_cutoffs)
+save_order_snapshots = writer(engine.save_order_snapshots)
+get_order_snapshot = reader(engine.get_order_snapshot)
+
+# ------------------------------
+# Archive
+# ------------------------------
+# holds the hot file's write lock for the whole move, so it queues with the other writes
+archive_orders = writer(engine.archive_orders)
+get_archived_report = reader(engine.get_archived_report)
+
+
+def close():
+    """
+    Wait for queued work, then close the pooled connections.
+    """
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
+    db.pool.close()
+    db.report_pool.close()
+    db.archive_pool.close()
@@ -0,0 +1,310 @@
+"""
+Offline load test for both bots.
+
+Builds admin_bot.dp and user_bot.dp against a fake Bot API session and
+feeds scripted updates through dp.feed_update:
+- an admin creates an order and its menu (typed, or uploaded as a CSV
+  with --import-menu)
+- many users send /start <order_id>, register and hammer inc_/dec_
+- admins keep pulling the overview and the bill while users tap
+
+Reports throughput, p50/p95/p99 latency per handler, waits for a pooled
+connection and for the writer thread, and how many Bot API calls were made. --engine memory runs
+the same scenario on memory_db to separate storage cost from the rest.
+
+    python benchmarks/loadtest.py --users 300 --taps 20
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+ADMIN_ID = 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ------------------------------
+# Fake Bot API
+# ------------------------------
+def fake_session_class():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import GetFile
+    from aiogram.types import Chat, File, Message
+
+    class FakeSession(BaseSession):
+        """
+        Answers every Bot API call locally after `latency` seconds.
+        Files registered with upload() can be downloaded again.
+        """
+
+        def __init__(self, latency=0.0):
+            super().__init__()
+            self.latency = latency
+            self.calls = defaultdict(int)
+            self.files = {}    # file_id -> bytes
+            self._message_ids = itertools.count(1)
+
+        def upload(self, file_id, content):
+            self.files[file_id] = content
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls[type(method).__name__] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if isinstance(method, GetFile):
+                content = self.files[method.file_id]
+                return File(file_id=method.file_id, file_unique_id=method.file_id,
+                            file_size=len(content), file_path=f"documents/{method.file_id}")
+            if method.__returning__ is Message:
+                chat_id = getattr(method, "chat_id", None) or 0
+                return Message(
+                    message_id=getattr(method, "message_id", None) or next(self._message_ids),
+                    date=datetime.now(),
+                    chat=Chat(id=chat_id, type="private"),
+                    text=getattr(method, "text", None),
+                ).as_(bot)
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            self.calls["download"] += 1
+            content = self.files[url.rsplit("/", 1)[-1]]
+            for i in range(0, len(content), chunk_size):
+                yield content[i:i + chunk_size]
+
+        async def close(self):
+            pass
+
+    return FakeSession
+
+
+# ------------------------------
+# Updates
+# ------------------------------
+class Feeder:
+
+    def __init__(self, dp, bot, stats):
+        self.dp = dp
+        self.bot = bot
+        self.stats = stats
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _message(self, user_id, text=None, message_id=None):
+        message = {
+            "message_id": message_id or next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    async def message(self, user_id, text):
+        name = text.split()[0].split("_")[0] if text.startswith("/") else "text"
+        await self._feed(name, {"update_id": next(self._ids), "message": self._message(user_id, text)})
+
+    async def document(self, user_id, filename, content):
+        file_id = f"file{next(self._ids)}"
+        self.bot.session.upload(file_id, content)
+        message = self._message(user_id)
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id,
+                               "file_name": filename, "file_size": len(content)}
+        await self._feed("document", {"update_id": next(self._ids), "message": message})
+
+    async def callback(self, user_id, data, message_id=1):
+        update = {
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "message": self._message(user_id, "menu", message_id),
+                "data": data,
+            },
+        }
+        await self._feed(data.split("_")[0] + "_", update)
+
+    async def _feed(self, name, data):
+        from aiogram.types import Update
+
+        update = Update.model_validate(data, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.stats.errors[f"{name} {type(e).__name__}: {e}"[:120]] += 1
+        self.stats.latencies[f"{self.label} {name}"].append(time.perf_counter() - started)
+
+    @property
+    def label(self):
+        return "admin" if self.bot.id == self.stats.admin_bot_id else "user"
+
+
+class Stats:
+
+    def __init__(self, admin_bot_id):
+        self.admin_bot_id = admin_bot_id
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# ------------------------------
+# Scenarios
+# ------------------------------
+async def admin_creates_order(admin, items, import_menu=False):
+    await admin.message(ADMIN_ID, "/neworder")
+    await admin.message(ADMIN_ID, "Load test trip")
+    import async_db
+    orders, _, _ = await async_db.get_orders_page(limit=1)
+    order_id = orders[0][0]
+
+    await admin.message(ADMIN_ID, f"/addmenu_{order_id}")
+    if import_menu:
+        csv = "name,price\n" + "".join(f"Item {i},{1000 + i * 250}\n" for i in range(items))
+        await admin.document(ADMIN_ID, "menu.csv", csv.encode())
+    else:
+        for i in range(items):
+            await admin.message(ADMIN_ID, f"Item {i}")
+            await admin.message(ADMIN_ID, str(1000 + i * 250))
+    await admin.message(ADMIN_ID, "/done")
+    return order_id
+
+
+async def user_session(user, user_id, order_id, menu_ids, taps, rng):
+    await user.message(user_id, f"/start {order_id}")
+    await user.message(user_id, f"Guest {user_id}")
+    for _ in range(taps):
+        menu_id = rng.choice(menu_ids)
+        await user.callback(user_id, f"item_{order_id}_{menu_id}")
+        for _ in range(rng.randint(1, 5)):
+            action = "inc" if rng.random() < 0.75 else "dec"
+            await user.callback(user_id, f"{action}_{order_id}_{menu_id}")
+        await user.callback(user_id, f"back_{order_id}")
+    await user.callback(user_id, f"viewcart_{order_id}")
+    await user.callback(user_id, f"send_{order_id}")
+
+
+async def admin_pulls_bills(admin, order_id, done, interval):
+    while not done.is_set():
+        await admin.callback(ADMIN_ID, f"overview_{order_id}")
+        await admin.callback(ADMIN_ID, f"bill_{order_id}")
+        await asyncio.sleep(interval)
+
+
+async def run(args):
+    import admin_bot
+    import async_db
+    import db
+    import user_bot
+
+    FakeSession = fake_session_class()
+    admin_session, user_session_ = FakeSession(args.latency), FakeSession(args.latency)
+    admin_bot.bot.session = admin_session
+    user_bot.bot.session = user_session_
+    if args.scheduler:
+        from scheduler import OutboundScheduler
+        scheduler = OutboundScheduler()
+        admin_session.middleware(scheduler)
+        user_session_.middleware(scheduler)
+
+    stats = Stats(admin_bot.bot.id)
+    admin = Feeder(admin_bot.dp, admin_bot.bot, stats)
+    user = Feeder(user_bot.dp, user_bot.bot, stats)
+    await admin_bot.dp.emit_startup(bot=admin_bot.bot)
+    await user_bot.dp.emit_startup(bot=user_bot.bot)
+
+    started = time.perf_counter()
+    order_id = await admin_creates_order(admin, args.items, args.import_menu)
+    menu_ids = [mid for mid, _, _ in await async_db.get_menus(order_id)]
+
+    rng = random.Random(args.seed)
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id):
+        async with limit:
+            await user_session(user, user_id, order_id, menu_ids, args.taps, random.Random(rng.random()))
+
+    done = asyncio.Event()
+    bills = [asyncio.create_task(admin_pulls_bills(admin, order_id, done, args.bill_interval))
+             for _ in range(args.admins)]
+    await asyncio.gather(*(limited(2000 + i) for i in range(args.users)))
+    done.set()
+    await asyncio.gather(*bills)
+
+    await user_bot.dp.emit_shutdown(bot=user_bot.bot)
+    await admin_bot.dp.emit_shutdown(bot=admin_bot.bot)
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for v in stats.latencies.values())
+    print(f"\n{total} updates in {elapsed:.2f}s -> {total / elapsed:.1f} updates/s ({args.engine})\n")
+    print(f"{'handler':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, values in sorted(stats.latencies.items()):
+        print(f"{name:<22}{len(values):>8}"
+              + "".join(f"{percentile(values, p) * 1000:>10.1f}" for p in (50, 95, 99))
+              + f"{max(values) * 1000:>10.1f}")
+
+    # SQLite's own lock waits (busy timeout) are not counted separately: they
+    # hold up the writer thread and show up as queue wait below
+    print(f"\nconnection pool: {db.pool.waits} waits for a free connection, "
+          f"{db.pool.wait_seconds * 1000:.1f} ms total")
+    writes = async_db.writer_stats["writes"]
+    print(f"writer thread: {writes} writes, "
+          f"{async_db.writer_stats['wait_seconds'] * 1000 / max(1, writes):.2f} ms average queue wait")
+    calls = defaultdict(int)
+    for session in (admin_session, user_session_):
+        for method, count in session.calls.items():
+            calls[method] += count
+    print("bot api calls: " + ", ".join(f"{m}={c}" for m, c in sorted(calls.items())))
+    if stats.errors:
+        print("\nerrors:")
+        for error, count in stats.errors.items():
+            print(f"  {count} x {error}")
+
+    if args.scheduler:
+        await scheduler.close()
+    async_db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--taps", type=int, default=10, help="items each user opens and taps on")
+    parser.add_argument("--items", type=int, default=30, help="menu size")
+    parser.add_argument("--import-menu", action="store_true", help="upload the menu as a CSV file")
+    parser.add_argument("--admins", type=int, default=2, help="admins pulling reports meanwhile")
+    parser.add_argument("--bill-interval", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Bot API latency in seconds")
+    parser.add_argument("--scheduler", action="store_true", help="route calls through OutboundScheduler")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="database file (default: a fresh temporary file)")
+    parser.add_argument("--engine", choices=("sqlite", "memory"), default="sqlite", help="storage engine")
+    args = parser.parse_args()
+
+    # باید قبل از import کردن ماژول‌های بات تنظیم شود
+    os.environ["DB_NAME"] = args.db or os.path.join(tempfile.mkdtemp(prefix="foodbot-bench-"), "bench.db")
+    os.environ["DB_ENGINE"] = args.engine
+    os.environ.setdefault("ADMIN_BOT_TOKEN", "1000001:bench-admin")
+    os.environ.setdefault("USER_BOT_TOKEN", "1000002:bench-user")
+    os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+    sys.path.insert(0, ROOT)
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
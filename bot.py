@@ -1,12 +1,35 @@
 import asyncio
 import admin_bot
+import async_db
+import metrics
 import user_bot
+import webhook
+from config import (ADMIN_WEBHOOK_PATH, ADMIN_WEBHOOK_SECRET, BOT_MODE,
+                    USER_WEBHOOK_PATH, USER_WEBHOOK_SECRET)
+from scheduler import OutboundScheduler
 
 async def run_bots():
-    task1 = asyncio.create_task(admin_bot.main())
-    task2 = asyncio.create_task(user_bot.main())
+    # یک صف خروجی مشترک برای هر دو بات
+    scheduler = OutboundScheduler()
+    admin_bot.bot.session.middleware(scheduler)
+    user_bot.bot.session.middleware(scheduler)
 
-    await asyncio.gather(task1, task2)
+    metrics_runner = await metrics.serve()
+    try:
+        if BOT_MODE == "webhook":
+            await webhook.serve([
+                (admin_bot.dp, admin_bot.bot, ADMIN_WEBHOOK_PATH, ADMIN_WEBHOOK_SECRET),
+                (user_bot.dp, user_bot.bot, USER_WEBHOOK_PATH, USER_WEBHOOK_SECRET),
+            ])
+        else:
+            task1 = asyncio.create_task(admin_bot.main())
+            task2 = asyncio.create_task(user_bot.main())
+            await asyncio.gather(task1, task2)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await scheduler.close()
+        async_db.close()
 
 if __name__ == "__main__":
     asyncio.run(run_bots())
@@ -0,0 +1,217 @@
+"""
+In-process caches used by the db layer.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import MENU_CACHE_SIZE, USER_CACHE_SIZE, USER_CACHE_TTL
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded mapping; the least recently used key is evicted.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._removed(key, self._data.pop(key))
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                old_key, old_value = self._data.popitem(last=False)
+                self._removed(old_key, old_value)
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                value = self._data.pop(key)
+                self._removed(key, value)
+                return value
+        return None
+
+    def clear(self):
+        with self._lock:
+            for key, value in list(self._data.items()):
+                self._removed(key, value)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _removed(self, key, value):
+        """
+        Hook for subclasses that keep secondary indexes.
+        """
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire `ttl` seconds after they were set.
+    """
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            hit = super().get(key)
+            if hit is None:
+                return default
+            if time.monotonic() - hit[0] > self.ttl:
+                self.pop(key)
+                return default
+            return hit[1]
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic(), value))
+
+
+# ------------------------------
+# Menu cache
+# ------------------------------
+class OrderMenu:
+    """
+    Cached view of one order: its title, lifecycle status and menu rows,
+    indexed by menu_id.
+    """
+    __slots__ = ("order_id", "title", "status", "closes_at", "menus", "items", "template")
+
+    def __init__(self, order_id, title, menus, status=None, closes_at=None):
+        self.order_id = order_id
+        self.title = title
+        # None when the order does not exist (or was archived)
+        self.status = status
+        self.closes_at = closes_at
+        self.menus = menus
+        self.items = {mid: (name, price) for mid, name, price in menus}
+        # render.MenuTemplate, built on first use
+        self.template = None
+
+    def is_open(self):
+        """
+        Whether carts may still change; a passed cutoff counts as closed
+        even before the scheduler has closed the order.
+        """
+        return self.status == "open" and (self.closes_at is None or time.time() < self.closes_at)
+
+
+class MenuCache(LRUCache):
+    """
+    order_id -> OrderMenu, with a secondary menu_id -> order_id index.
+    """
+
+    def __init__(self, maxsize=MENU_CACHE_SIZE):
+        super().__init__(maxsize)
+        self._by_menu = {}
+        # bumped on every invalidation so a load that raced a write is not stored
+        self.version = 0
+        # callables(order_id) told about local invalidations (supervisor.py relays them)
+        self.listeners = []
+
+    def set(self, order_id, entry, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            super().set(order_id, entry)
+            for mid in entry.items:
+                self._by_menu[mid] = order_id
+
+    def invalidate(self, order_id, notify=True):
+        with self._lock:
+            self.version += 1
+            self.pop(order_id)
+        if notify:
+            for listener in self.listeners:
+                listener(order_id)
+
+    def item(self, menu_id):
+        """
+        (name, price) of a cached menu item, or None.
+        """
+        with self._lock:
+            order_id = self._by_menu.get(menu_id)
+            if order_id is None:
+                return None
+            entry = self.get(order_id)
+            return entry.items.get(menu_id) if entry else None
+
+    def _removed(self, order_id, entry):
+        for mid in entry.items:
+            self._by_menu.pop(mid, None)
+
+
+menus = MenuCache()
+
+
+# ------------------------------
+# Report cache
+# ------------------------------
+class ReportCache(LRUCache):
+    """
+    (report function, order_id) -> (read at, report), see db.snapshot_cached.
+    """
+
+    def __init__(self, maxsize=256):
+        super().__init__(maxsize)
+        # bumped on every invalidation so a read that raced a write is not stored
+        self.version = 0
+        # callables(order_id) told about local invalidations (supervisor.py relays them)
+        self.listeners = []
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            super().set(key, value)
+
+    def invalidate(self, order_id, notify=True):
+        with self._lock:
+            self.version += 1
+            for key in [key for key in self._data if key[1] == order_id]:
+                self.pop(key)
+        if notify:
+            for listener in self.listeners:
+                listener(order_id)
+
+
+reports = ReportCache()
+
+
+# ------------------------------
+# User cache
+# ------------------------------
+class UserCache(TTLCache):
+    """
+    user_id -> (id, fullname, username), filled by db.get_user and written
+    through by add_user / update_user_name.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        # callables(user_id) told about local writes (supervisor.py relays them)
+        self.listeners = []
+
+    def changed(self, user):
+        self.set(user[0], user)
+        for listener in self.listeners:
+            listener(user[0])
+
+    def invalidate(self, user_id):
+        self.pop(user_id)
+
+
+users = UserCache()
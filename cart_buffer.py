@@ -0,0 +1,100 @@
+"""
+Write-behind buffer for cart +/- taps.
+
+Rapid taps on the same (user, order, menu) key are folded into one net
+write that is flushed after a short delay or on shutdown. Pending
+quantities are absolute, so the value shown on screen is always the
+buffered one.
+"""
+import asyncio
+import logging
+
+import async_db
+from config import CART_FLUSH_DELAY, CART_WRITE_BEHIND
+
+
+class CartBuffer:
+
+    def __init__(self, enabled=CART_WRITE_BEHIND, delay=CART_FLUSH_DELAY):
+        self.enabled = enabled
+        self.delay = delay
+        self._pending = {}    # (user_id, order_id, menu_id) -> quantity
+        self._flushing = {}   # written to the db but not committed yet
+        self._loading = {}    # key -> task reading the base quantity
+        self._timer = None
+
+    async def change(self, user_id, order_id, menu_id, qty_change):
+        """
+        Apply a +/- tap and return the new quantity.
+        """
+        if not self.enabled:
+            return await async_db.update_cart(user_id, order_id, menu_id, qty_change)
+
+        key = (user_id, order_id, menu_id)
+        if key not in self._pending:
+            base = await self._base(key)
+            self._pending.setdefault(key, base)
+        self._pending[key] = max(0, self._pending[key] + qty_change)
+        self._schedule()
+        return self._pending[key]
+
+    def quantity(self, user_id, order_id, menu_id, default=0):
+        key = (user_id, order_id, menu_id)
+        return self._pending.get(key, self._flushing.get(key, default))
+
+    def overlay(self, user_id, order_id, cart_items):
+        """
+        Update a {menu_id: quantity} dict read from the db with buffered values.
+        """
+        for source in (self._flushing, self._pending):
+            for (uid, oid, mid), qty in source.items():
+                if uid == user_id and oid == order_id:
+                    cart_items[mid] = qty
+        return cart_items
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        self._flushing.update(batch)
+        try:
+            await async_db.set_cart_quantities([key + (qty,) for key, qty in batch.items()])
+        except Exception:
+            # دوباره در صف می‌ماند مگر اینکه مقدار جدیدتری آمده باشد
+            for key, qty in batch.items():
+                self._pending.setdefault(key, qty)
+            self._schedule()
+            raise
+        finally:
+            for key, qty in batch.items():
+                if self._flushing.get(key) == qty:
+                    del self._flushing[key]
+
+    async def _base(self, key):
+        if key in self._flushing:
+            return self._flushing[key]
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(async_db.get_cart_quantity(*key))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await task
+
+    def _schedule(self):
+        if self._timer is None and self._pending:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        task.add_done_callback(_log_failure)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception():
+        logging.error("Cart flush failed", exc_info=task.exception())
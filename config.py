@@ -3,6 +3,56 @@ import os
 
 ADMIN_BOT_TOKEN = os.getenv("ADMIN_BOT_TOKEN") or None
 USER_BOT_TOKEN=os.getenv("USER_BOT_TOKEN") or None
-ADMIN_IDS = os.getenv("ADMIN_IDS") or None   # Replace with your Telegram user ID
+ADMIN_IDS = [int(i) for i in (os.getenv("ADMIN_IDS") or "").split(",") if i.strip()]   # comma-separated Telegram user IDs
 USER_BOT_USERNAME = "Piki_Food_bot"
-DB_NAME = "foodbot.db"
+DB_NAME = os.getenv("DB_NAME") or "foodbot.db"
+ARCHIVE_DB_NAME = os.getenv("ARCHIVE_DB_NAME") or "foodbot_archive.db"
+DB_ENGINE = os.getenv("DB_ENGINE") or "sqlite"   # "sqlite" or "memory" (memory_db.py, benchmarks only)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or 4)
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT") or 10)   # seconds to wait for another process' write lock
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE") or 128)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE") or 10000)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL") or 600)   # seconds; bounds staleness across processes
+CART_WRITE_BEHIND = os.getenv("CART_WRITE_BEHIND") == "1"
+CART_FLUSH_DELAY = float(os.getenv("CART_FLUSH_DELAY") or 0.5)
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE") or 10000)
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE") or 30)   # requests per second per bot
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE") or 1)        # requests per second per chat
+
+# Serving mode: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE") or "polling"
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or None   # public https://host the bots are reachable at
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST") or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("PORT") or os.getenv("WEBHOOK_PORT") or 8080)
+ADMIN_WEBHOOK_PATH = os.getenv("ADMIN_WEBHOOK_PATH") or "/webhook/admin"
+USER_WEBHOOK_PATH = os.getenv("USER_WEBHOOK_PATH") or "/webhook/user"
+ADMIN_WEBHOOK_SECRET = os.getenv("ADMIN_WEBHOOK_SECRET") or None
+USER_WEBHOOK_SECRET = os.getenv("USER_WEBHOOK_SECRET") or None
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES") or 64)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or None   # e.g. a local fake Bot API for testing
+
+# FSM storage
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE") or 5000)
+FSM_TTL = int(os.getenv("FSM_TTL") or 24 * 3600)               # seconds before an idle state is dropped
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY") or 1.0)
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE") or 10)
+
+# Reports read from their own read-only connections
+REPORT_POOL_SIZE = int(os.getenv("REPORT_POOL_SIZE") or 2)
+REPORT_MAX_AGE = float(os.getenv("REPORT_MAX_AGE") or 3)     # seconds a report may be reused; 0 disables
+LIVE_REPORT_INTERVAL = float(os.getenv("LIVE_REPORT_INTERVAL") or 5)   # min seconds between edits of an open report; 0 disables
+LIVE_REPORT_TTL = float(os.getenv("LIVE_REPORT_TTL") or 30 * 60)       # seconds an open report keeps following the carts
+
+# Orders older than ARCHIVE_AFTER_DAYS are moved to ARCHIVE_DB_NAME every ARCHIVE_INTERVAL seconds
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS") or 30)   # 0 disables the background job
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL") or 6 * 3600)
+
+# Metrics
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 9100)          # 0 disables the endpoint
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 0)         # 0 disables the slow query log
+
+# supervisor.py: one admin worker process plus USER_WORKERS user-bot processes
+USER_WORKERS = int(os.getenv("USER_WORKERS") or 1)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT") or 20)   # seconds a worker gets to drain on stop
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE") or 1000)  # messages queued per worker before new ones are dropped
@@ -0,0 +1,52 @@
+"""
+Scheduled order cutoffs, run by the admin bot.
+
+Every open order with a closes_at time gets one timer on the event loop;
+when it fires the order is closed. Timers are rebuilt from the database on
+startup, so a cutoff that passed while the bot was down closes the order
+right away. The user bot does not wait for the timer: a passed cutoff
+already counts as closed there (cache.OrderMenu.is_open).
+"""
+import asyncio
+import logging
+import time
+
+
+class CutoffScheduler:
+
+    def __init__(self, close):
+        """
+        close: coroutine(order_id) run when a cutoff is reached.
+        """
+        self.close = close
+        self._timers = {}    # order_id -> asyncio.TimerHandle
+        self._tasks = set()
+
+    def schedule(self, order_id, closes_at):
+        self.cancel(order_id)
+        loop = asyncio.get_running_loop()
+        self._timers[order_id] = loop.call_later(max(0.0, closes_at - time.time()), self._fire, order_id)
+
+    def cancel(self, order_id):
+        timer = self._timers.pop(order_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _fire(self, order_id):
+        self._timers.pop(order_id, None)
+        task = asyncio.ensure_future(self._close(order_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close(self, order_id):
+        try:
+            await self.close(order_id)
+        except Exception:
+            logging.exception("Closing order %s at its cutoff failed", order_id)
+
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,57 +1,275 @@
+import functools
+import os
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import cache
+import pubsub
+from config import (ARCHIVE_DB_NAME, DB_BUSY_TIMEOUT, DB_NAME, DB_POOL_SIZE, ORDERS_PAGE_SIZE, REPORT_MAX_AGE,
+                    REPORT_POOL_SIZE)
+
+DB_PATH = DB_NAME
+ARCHIVE_PATH = ARCHIVE_DB_NAME
+
+
+# ------------------------------
+# Query instrumentation
+# ------------------------------
+# query_hook(sql, seconds, rows, call) is called for every statement run
+# through a pooled connection: once when it executes (call=True) and again
+# for each fetch (call=False). Set with set_query_hook; None disables it.
+query_hook = None
+
+
+def set_query_hook(hook):
+    global query_hook
+    query_hook = hook
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        if query_hook is None:
+            return super().execute(sql, parameters)
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            query_hook(sql, time.perf_counter() - started, max(self.rowcount, 0), True)
+
+    def executemany(self, sql, seq_of_parameters):
+        if query_hook is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            query_hook(sql, time.perf_counter() - started, max(self.rowcount, 0), True)
+
+    def fetchone(self):
+        if query_hook is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        query_hook(getattr(self, "_sql", ""), time.perf_counter() - started, 1 if row is not None else 0, False)
+        return row
+
+    def fetchall(self):
+        if query_hook is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        query_hook(getattr(self, "_sql", ""), time.perf_counter() - started, len(rows), False)
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ------------------------------
+# Connection pool
+# ------------------------------
+class ConnectionPool:
+    """
+    Small pool of long-lived connections.
+    Every connection is tuned once when it is opened (WAL, synchronous=NORMAL,
+    statement cache) instead of paying connect + fsync on every call.
+
+    Several processes may share the file (supervisor.py): write transactions
+    start with BEGIN IMMEDIATE, so a writer takes the lock up front and waits
+    up to DB_BUSY_TIMEOUT for it instead of failing halfway through.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE, readonly=False):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        # how often and how long callers waited for a free connection
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _open(self):
+        if self.readonly:
+            # transactions are opened explicitly by snapshot()
+            uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+            return sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256,
+                                   timeout=DB_BUSY_TIMEOUT, isolation_level=None,
+                                   factory=InstrumentedConnection)
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256,
+                               timeout=DB_BUSY_TIMEOUT, isolation_level="IMMEDIATE",
+                               factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        started = time.perf_counter()
+        conn = self._idle.get()
+        self.waits += 1
+        self.wait_seconds += time.perf_counter() - started
+        return conn
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection; commit on success, rollback on error.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._opened -= 1
+
+
+pool = ConnectionPool(DB_PATH)
+# read-only connections for reports, so they never queue behind cart reads
+report_pool = ConnectionPool(DB_PATH, REPORT_POOL_SIZE, readonly=True)
+# /export of archived orders
+archive_pool = ConnectionPool(ARCHIVE_PATH, 1, readonly=True)
+
+
+def connection():
+    return pool.connection()
+
+
+@contextmanager
+def snapshot(source=None):
+    """
+    Read-only connection inside one read transaction: in WAL mode every
+    query sees the same committed state, while writers carry on.
+    """
+    source = source or report_pool
+    conn = source.acquire()
+    try:
+        conn.execute("BEGIN")
+        yield conn
+    finally:
+        conn.rollback()
+        source.release(conn)
+
+
+# (report function, order_id) -> [lock, callers using it]; an entry lives
+# only while some caller is filling or waiting for that report
+_fill_locks = {}
+_fill_locks_guard = threading.Lock()
+
+
+def snapshot_cached(fn):
+    """
+    Reuse a report of the same order for REPORT_MAX_AGE seconds; callers
+    asking at the same time share one read. Results must not be modified.
+    """
+    @functools.wraps(fn)
+    def wrapper(order_id):
+        if not REPORT_MAX_AGE:
+            return fn(order_id)
+        key = (fn.__name__, order_id)
+        with _fill_locks_guard:
+            fill = _fill_locks.get(key)
+            if fill is None:
+                fill = _fill_locks[key] = [threading.Lock(), 0]
+            fill[1] += 1
+        try:
+            with fill[0]:
+                hit = cache.reports.get(key)
+                if hit is not None and time.monotonic() - hit[0] < REPORT_MAX_AGE:
+                    return hit[1]
+                started = time.monotonic()
+                version = cache.reports.version
+                report = fn(order_id)
+                cache.reports.set(key, (started, report), version)
+                return report
+        finally:
+            with _fill_locks_guard:
+                fill[1] -= 1
+                if not fill[1]:
+                    del _fill_locks[key]
+    return wrapper
+
+
+def forget_reports(order_id):
+    # در حالت چند پردازه‌ای به workerهای دیگر هم می‌رسد (supervisor.py)
+    cache.reports.invalidate(order_id)
 
-DB_PATH = "foodbot.db"
 
 # ------------------------------
 # Initialize database and tables
 # ------------------------------
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+ARCHIVE_MIGRATIONS_DIR = os.path.join(MIGRATIONS_DIR, "archive")
+
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.executescript("""
-    CREATE TABLE IF NOT EXISTS orders_table (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        created_by INTEGER NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-
-    CREATE TABLE IF NOT EXISTS menus (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        name TEXT NOT NULL,
-        price INTEGER NOT NULL,
-        FOREIGN KEY(order_id) REFERENCES orders_table(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        fullname TEXT NOT NULL,
-        username TEXT
-    );
-
-    CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        menu_id INTEGER NOT NULL,
-        order_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL DEFAULT 1,
-        status TEXT DEFAULT 'pending',
-        FOREIGN KEY(user_id) REFERENCES users(id),
-        FOREIGN KEY(menu_id) REFERENCES menus(id),
-        FOREIGN KEY(order_id) REFERENCES orders_table(id)
-    );
-
-    CREATE TABLE IF NOT EXISTS cart (
-        user_id INTEGER,
-        order_id INTEGER,
-        menu_id INTEGER,
-        quantity INTEGER DEFAULT 0,
-        PRIMARY KEY (user_id, order_id, menu_id)
-    );
-    """)
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        migrate(conn)
+
+
+def migrate(conn, directory=MIGRATIONS_DIR):
+    """
+    Apply every migrations/NNNN_*.sql newer than PRAGMA user_version,
+    each in its own transaction together with the version bump.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".sql"):
+            continue
+        number = int(filename.split("_", 1)[0])
+        if number <= version:
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            script = f.read()
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
 
 
 # ------------------------------
@@ -61,203 +279,540 @@ def add_user(user_id, fullname, username):
     """
     Add a new user or update existing user.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO users (id, fullname, username) 
-        VALUES (?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET 
-            fullname = excluded.fullname,
-            username = excluded.username
-    """, (user_id, fullname, username))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("""
+            INSERT INTO users (id, fullname, username) 
+            VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET 
+                fullname = excluded.fullname,
+                username = excluded.username
+        """, (user_id, fullname, username))
+    cache.users.changed((user_id, fullname, username))
 
 
 def get_user(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, fullname, username FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    """
+    (id, fullname, username) or None, served from cache.users when possible.
+    """
+    user = cache.users.get(user_id)
+    if user is None:
+        with connection() as conn:
+            cursor = conn.execute("SELECT id, fullname, username FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+        if user is not None:
+            cache.users.set(user_id, user)
     return user
 
 
 def update_user_name(user_id, new_name):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET fullname = ? WHERE id = ?", (new_name, user_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        user = conn.execute("UPDATE users SET fullname = ? WHERE id = ? RETURNING id, fullname, username",
+                            (new_name, user_id)).fetchone()
+    if user is not None:
+        cache.users.changed(user)
 
 
 # ------------------------------
 # Order functions
 # ------------------------------
 def create_order(title, created_by):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO orders_table (title, created_by) VALUES (?, ?)", (title, created_by))
-    order_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("INSERT INTO orders_table (title, created_by) VALUES (?, ?)", (title, created_by))
+        order_id = cursor.lastrowid
+    cache.menus.invalidate(order_id)
     return order_id
 
 
 def get_order(order_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, created_by FROM orders_table WHERE id = ?", (order_id,))
-    order = cursor.fetchone()
-    conn.close()
-    return order
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, title, created_by FROM orders_table WHERE id = ?", (order_id,))
+        return cursor.fetchone()
+
+
+class OrderClosed(Exception):
+    """
+    A cart write was refused because the order is closed.
+    """
+
+
+def _is_closed(conn, order_id):
+    row = conn.execute("SELECT status FROM orders_table WHERE id = ?", (order_id,)).fetchone()
+    return row is not None and row[0] == "closed"
+
+
+def get_orders_page(before_id=None, after_id=None, prefix=None, limit=ORDERS_PAGE_SIZE):
+    """
+    One page of (id, title), newest first, using keyset pagination on id:
+    before_id pages to older orders, after_id to newer ones; prefix filters
+    by title. Returns (rows, has_older, has_newer).
+    """
+    where, params = [], []
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    if after_id is not None:
+        where.append("id > ?")
+        params.append(after_id)
+    if prefix:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append("title LIKE ? ESCAPE '\\'")
+        params.append(escaped + "%")
+    sql = "SELECT id, title FROM orders_table"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    # برای صفحه‌ی جدیدتر صعودی می‌خوانیم و بعد برمی‌گردانیم
+    sql += " ORDER BY id ASC LIMIT ?" if after_id is not None else " ORDER BY id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is not None:
+        rows.reverse()
+        return rows, True, more
+    return rows, more, before_id is not None
 
 
 def add_menu(order_id, name, price):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO menus (order_id, name, price) VALUES (?, ?, ?)", (order_id, name, price))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("INSERT INTO menus (order_id, name, price) VALUES (?, ?, ?)", (order_id, name, price))
+    cache.menus.invalidate(order_id)
+
+
+def add_menus(order_id, items):
+    """
+    Insert many (name, price) items with one executemany in one transaction.
+    """
+    with connection() as conn:
+        conn.executemany("INSERT INTO menus (order_id, name, price) VALUES (?, ?, ?)",
+                         [(order_id, name, price) for name, price in items])
+    cache.menus.invalidate(order_id)
+    return len(items)
 
 
 def get_menus(order_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, price FROM menus WHERE order_id = ?", (order_id,))
-    menus = cursor.fetchall()
-    conn.close()
-    return menus
+    return get_order_menu(order_id).menus
+
+
+def get_order_menu(order_id):
+    """
+    Title, status and menu rows of an order, served from cache.menus.
+    The entry is dropped whenever add_menu, create_order or a lifecycle
+    change writes.
+    """
+    entry = cache.menus.get(order_id)
+    if entry is None:
+        version = cache.menus.version
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT title, status, closes_at FROM orders_table WHERE id = ?", (order_id,))
+            order = cursor.fetchone() or (None, None, None)
+            cursor.execute("SELECT id, name, price FROM menus WHERE order_id = ?", (order_id,))
+            menus = cursor.fetchall()
+        entry = cache.OrderMenu(order_id, order[0], menus, order[1], order[2])
+        cache.menus.set(order_id, entry, version)
+    return entry
+
+
+def get_menu_screen(user_id, order_id):
+    """
+    Everything the user bot's main menu needs:
+    (cached get_order_menu entry, {menu_id: quantity} of the user's cart)
+    Title and menus come from the cache, so only the cart is read.
+    """
+    entry = get_order_menu(order_id)
+    with connection() as conn:
+        cursor = conn.execute("SELECT menu_id, quantity FROM cart WHERE user_id = ? AND order_id = ?",
+                              (user_id, order_id))
+        cart_items = dict(cursor.fetchall())
+    return entry, cart_items
+
+
+def get_item_screen(user_id, order_id, menu_id):
+    """
+    ((name, price) of the menu item, quantity in the user's cart)
+    """
+    item = cache.menus.item(menu_id) or get_order_menu(order_id).items.get(menu_id)
+    return item, get_cart_quantity(user_id, order_id, menu_id)
 
 
 # ------------------------------
 # Cart functions
 # ------------------------------
 def update_cart(user_id, order_id, menu_id, qty_change):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT quantity FROM cart WHERE user_id = ? AND order_id = ? AND menu_id = ?",
-                   (user_id, order_id, menu_id))
-    row = cursor.fetchone()
-    if row:
-        new_qty = max(0, row[0] + qty_change)
-        cursor.execute("UPDATE cart SET quantity = ? WHERE user_id = ? AND order_id = ? AND menu_id = ?",
-                       (new_qty, user_id, order_id, menu_id))
-        if new_qty == 0:
-            cursor.execute("DELETE FROM cart WHERE user_id = ? AND order_id = ? AND menu_id = ?",
-                           (user_id, order_id, menu_id))
-    else:
+    """
+    Apply a +/- change atomically and return the new quantity.
+    The row is removed instead of being left at 0. Raises OrderClosed when
+    the order is closed (the cart_closed_* triggers skip the write).
+    """
+    with connection() as conn:
         if qty_change > 0:
-            cursor.execute("INSERT INTO cart (user_id, order_id, menu_id, quantity) VALUES (?, ?, ?, ?)",
-                           (user_id, order_id, menu_id, qty_change))
-    conn.commit()
-    conn.close()
+            cursor = conn.execute("""
+                INSERT INTO cart (user_id, order_id, menu_id, quantity) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, order_id, menu_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                RETURNING quantity
+            """, (user_id, order_id, menu_id, qty_change))
+            row = cursor.fetchone()
+            if row is None:
+                # skipped by the cart_closed_insert trigger
+                raise OrderClosed(order_id)
+            quantity = row[0]
+        else:
+            cursor = conn.execute("""
+                UPDATE cart SET quantity = quantity + ?
+                WHERE user_id = ? AND order_id = ? AND menu_id = ? AND quantity + ? > 0
+                RETURNING quantity
+            """, (qty_change, user_id, order_id, menu_id, qty_change))
+            row = cursor.fetchone()
+            if row:
+                quantity = row[0]
+            else:
+                deleted = conn.execute("DELETE FROM cart WHERE user_id = ? AND order_id = ? AND menu_id = ?",
+                                       (user_id, order_id, menu_id)).rowcount
+                if not deleted and _is_closed(conn, order_id):
+                    raise OrderClosed(order_id)
+                quantity = 0
+    pubsub.cart_changes.publish(order_id, ((user_id, menu_id, quantity),))
+    return quantity
+
+
+def set_cart_quantities(rows):
+    """
+    Write absolute quantities for many (user_id, order_id, menu_id, quantity)
+    rows in one transaction; quantity 0 removes the row.
+    """
+    upserts = [row for row in rows if row[3] > 0]
+    deletes = [row[:3] for row in rows if row[3] <= 0]
+    with connection() as conn:
+        conn.executemany("""
+            INSERT INTO cart (user_id, order_id, menu_id, quantity) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, order_id, menu_id) DO UPDATE SET quantity = excluded.quantity
+        """, upserts)
+        conn.executemany("DELETE FROM cart WHERE user_id = ? AND order_id = ? AND menu_id = ?", deletes)
+    pubsub.publish_cart_rows(rows)
 
 
 def get_cart(user_id, order_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT m.id, m.name, m.price, c.quantity
-    FROM cart c
-    JOIN menus m ON c.menu_id = m.id
-    WHERE c.user_id = ? AND c.order_id = ?
-    """, (user_id, order_id))
-    cart = cursor.fetchall()
-    conn.close()
-    return cart
+    with connection() as conn:
+        cursor = conn.execute("""
+        SELECT m.id, m.name, m.price, c.quantity
+        FROM cart c
+        JOIN menus m ON c.menu_id = m.id
+        WHERE c.user_id = ? AND c.order_id = ?
+        """, (user_id, order_id))
+        return cursor.fetchall()
+
+
+def get_cart_quantity(user_id, order_id, menu_id):
+    with connection() as conn:
+        cursor = conn.execute("SELECT quantity FROM cart WHERE user_id = ? AND order_id = ? AND menu_id = ?",
+                              (user_id, order_id, menu_id))
+        row = cursor.fetchone()
+    return row[0] if row else 0
 
 
 def clear_cart(user_id, order_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM cart WHERE user_id = ? AND order_id = ?", (user_id, order_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM cart WHERE user_id = ? AND order_id = ?", (user_id, order_id))
+    pubsub.cart_changes.publish(order_id, ((user_id, None, 0),))
 
 
 # ------------------------------
 # Order finalization
 # ------------------------------
 def add_order(user_id, order_id, menu_id, quantity):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO order_items (user_id, order_id, menu_id, quantity) VALUES (?, ?, ?, ?)",
-                   (user_id, order_id, menu_id, quantity))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("""
+            INSERT INTO order_items (user_id, order_id, menu_id, quantity, finalized_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(order_id, user_id, menu_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity, finalized_at = excluded.finalized_at
+        """, (user_id, order_id, menu_id, quantity))
+    forget_reports(order_id)
+
+
+def finalize_cart(user_id, order_id):
+    """
+    Copy one user's cart into order_items in a single transaction and
+    return how many items were finalized.
+    The user's previous finalized rows are replaced, so sending twice
+    (or again after changing the cart) never duplicates anything.
+    """
+    with connection() as conn:
+        conn.execute("DELETE FROM order_items WHERE order_id = ? AND user_id = ?", (order_id, user_id))
+        items = conn.execute("""
+            INSERT INTO order_items (user_id, order_id, menu_id, quantity, status, finalized_at)
+            SELECT user_id, order_id, menu_id, quantity, 'finalized', CURRENT_TIMESTAMP
+            FROM cart
+            WHERE user_id = ? AND order_id = ? AND quantity > 0
+        """, (user_id, order_id)).rowcount
+    # /export باید سفارش نهایی‌شده را فوراً ببیند
+    forget_reports(order_id)
+    return items
+
+
+def finalize_order(order_id):
+    """
+    Finalize every cart of an order at once; returns (users, items).
+    """
+    with connection() as conn:
+        conn.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
+        items = conn.execute("""
+            INSERT INTO order_items (user_id, order_id, menu_id, quantity, status, finalized_at)
+            SELECT user_id, order_id, menu_id, quantity, 'finalized', CURRENT_TIMESTAMP
+            FROM cart
+            WHERE order_id = ? AND quantity > 0
+        """, (order_id,)).rowcount
+        users = conn.execute("SELECT COUNT(DISTINCT user_id) FROM order_items WHERE order_id = ?",
+                             (order_id,)).fetchone()[0]
+    forget_reports(order_id)
+    return users, items
+
+
+# ------------------------------
+# Order lifecycle
+# ------------------------------
+def close_order(order_id):
+    """
+    Close an open order: every cart is finalized as in finalize_order and
+    the carts are frozen, in one transaction. Returns (users, items), or
+    None when the order is missing or already closed.
+    """
+    with connection() as conn:
+        cursor = conn.execute("""
+            UPDATE orders_table SET status = 'closed', closed_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'open'
+        """, (order_id,))
+        if not cursor.rowcount:
+            return None
+        conn.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
+        items = conn.execute("""
+            INSERT INTO order_items (user_id, order_id, menu_id, quantity, status, finalized_at)
+            SELECT user_id, order_id, menu_id, quantity, 'finalized', CURRENT_TIMESTAMP
+            FROM cart
+            WHERE order_id = ? AND quantity > 0
+        """, (order_id,)).rowcount
+        users = conn.execute("SELECT COUNT(DISTINCT user_id) FROM order_items WHERE order_id = ?",
+                             (order_id,)).fetchone()[0]
+    cache.menus.invalidate(order_id)
+    forget_reports(order_id)
+    return users, items
+
+
+def reopen_order(order_id):
+    """
+    Open a closed order again and drop its snapshots. Returns False when it was not closed.
+    """
+    with connection() as conn:
+        cursor = conn.execute("""
+            UPDATE orders_table SET status = 'open', closed_at = NULL, closes_at = NULL
+            WHERE id = ? AND status = 'closed'
+        """, (order_id,))
+        if not cursor.rowcount:
+            return False
+        conn.execute("DELETE FROM order_snapshots WHERE order_id = ?", (order_id,))
+    cache.menus.invalidate(order_id)
+    return True
+
+
+def set_order_cutoff(order_id, closes_at):
+    """
+    Schedule (unix time) or clear (None) the cutoff of an open order.
+    Returns False when the order is missing or closed.
+    """
+    with connection() as conn:
+        cursor = conn.execute("UPDATE orders_table SET closes_at = ? WHERE id = ? AND status = 'open'",
+                              (closes_at, order_id))
+        updated = cursor.rowcount > 0
+    cache.menus.invalidate(order_id)
+    return updated
+
+
+def get_order_cutoffs():
+    """
+    (order_id, closes_at) of every open order with a cutoff.
+    """
+    with connection() as conn:
+        cursor = conn.execute("""
+            SELECT id, closes_at FROM orders_table
+            WHERE status = 'open' AND closes_at IS NOT NULL
+        """)
+        return cursor.fetchall()
+
+
+def save_order_snapshots(order_id, snapshots):
+    """
+    Store {kind: bytes} rendered for a closed order; ignored if it was reopened meanwhile.
+    """
+    with connection() as conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO order_snapshots (order_id, kind, data)
+            SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM orders_table WHERE id = ? AND status = 'closed')
+        """, [(order_id, kind, data, order_id) for kind, data in snapshots.items()])
+
+
+def get_order_snapshot(order_id, kind):
+    """
+    Snapshot bytes of a closed order, from the archive once the order is archived; None if missing.
+    """
+    with snapshot() as conn:
+        row = conn.execute("SELECT data FROM order_snapshots WHERE order_id = ? AND kind = ?",
+                           (order_id, kind)).fetchone()
+    if row is None and os.path.exists(ARCHIVE_PATH):
+        with snapshot(archive_pool) as conn:
+            row = conn.execute("SELECT data FROM order_snapshots WHERE order_id = ? AND kind = ?",
+                               (order_id, kind)).fetchone()
+    return row[0] if row else None
+
+
+# ------------------------------
+# FSM storage
+# ------------------------------
+def load_fsm_state(key):
+    """
+    (state, data as JSON text, updated_at) or None.
+    """
+    with connection() as conn:
+        cursor = conn.execute("SELECT state, data, updated_at FROM fsm_state WHERE key = ?", (key,))
+        return cursor.fetchone()
+
+
+def save_fsm_states(rows):
+    """
+    Write many (key, state, data JSON, updated_at) rows in one transaction;
+    a row with no state and no data is deleted instead.
+    """
+    upserts = [row for row in rows if row[1] is not None or row[2] != "{}"]
+    deletes = [(row[0],) for row in rows if row[1] is None and row[2] == "{}"]
+    with connection() as conn:
+        conn.executemany("""
+            INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+        """, upserts)
+        conn.executemany("DELETE FROM fsm_state WHERE key = ?", deletes)
+
+
+def purge_fsm_states(before):
+    """
+    Drop FSM state untouched since `before` (unix time); returns how many.
+    """
+    with connection() as conn:
+        return conn.execute("DELETE FROM fsm_state WHERE updated_at < ?", (before,)).rowcount
 
 
 # ------------------------------
 # Report
 # ------------------------------
+@snapshot_cached
 def get_report(order_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    with snapshot() as conn:
+        return _report(conn, order_id)
+
+
+def _report(conn, order_id):
+    cursor = conn.execute("""
     SELECT m.name, SUM(oi.quantity) as total, SUM(oi.quantity * m.price) as total_price
     FROM order_items oi
     JOIN menus m ON oi.menu_id = m.id
     WHERE oi.order_id = ?
     GROUP BY oi.menu_id
     """, (order_id,))
-    report = cursor.fetchall()
-    conn.close()
-    return report
+    return cursor.fetchall()
+
+
+def user_names(conn, user_ids):
+    """
+    {user_id: fullname} for report rows, from cache.users where possible;
+    the rest is loaded with one query and cached.
+    """
+    names, missing = {}, []
+    for user_id in user_ids:
+        user = cache.users.get(user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            names[user_id] = user[1]
+    for i in range(0, len(missing), 500):
+        part = missing[i:i + 500]
+        cursor = conn.execute(f"SELECT id, fullname, username FROM users WHERE id IN ({','.join('?' * len(part))})",
+                              part)
+        for user in cursor.fetchall():
+            cache.users.set(user[0], user)
+            names[user[0]] = user[1]
+    return names
+
+
+@snapshot_cached
 def get_cart_report_summary(order_id):
     """
     Returns a summary report from the cart table:
     - For each user: items and quantities
-    - Total quantities per item across all users
+    - Total quantities per item across all users (from order_item_totals)
     Output format:
     {
         "users": {
-            user_fullname: {item_name: quantity, ...},
+            user_id: {item_name: quantity, ...},
             ...
         },
+        "names": {user_id: fullname, ...},
         "totals": {
             item_name: total_quantity,
             ...
         }
     }
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
     # گرفتن تمامی آیتم‌ها و تعداد هر کاربر
-    cursor.execute("""
-        SELECT u.fullname, m.name, c.quantity
-        FROM cart c
-        JOIN users u ON c.user_id = u.id
-        JOIN menus m ON c.menu_id = m.id
-        WHERE c.order_id = ?
-    """, (order_id,))
-    rows = cursor.fetchall()
-
-    conn.close()
-
-    report = {"users": {}, "totals": {}}
-
-    for fullname, item_name, qty in rows:
-        # اضافه کردن به کاربران
-        if fullname not in report["users"]:
-            report["users"][fullname] = {}
-        report["users"][fullname][item_name] = report["users"][fullname].get(item_name, 0) + qty
-
-        # اضافه کردن به مجموع کل
+    with snapshot() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.user_id, m.name, c.quantity
+            FROM cart c
+            JOIN menus m ON c.menu_id = m.id
+            WHERE c.order_id = ?
+        """, (order_id,))
+        rows = cursor.fetchall()
+
+        # مجموع کل از جدول تجمیعی
+        cursor.execute("""
+            SELECT m.name, t.quantity
+            FROM order_item_totals t
+            JOIN menus m ON t.menu_id = m.id
+            WHERE t.order_id = ?
+        """, (order_id,))
+        totals = cursor.fetchall()
+
+        report = {"users": {}, "names": {}, "totals": {}}
+        for user_id, item_name, qty in rows:
+            items = report["users"].setdefault(user_id, {})
+            items[item_name] = items.get(item_name, 0) + qty
+        report["names"] = user_names(conn, list(report["users"]))
+
+    for item_name, qty in totals:
         report["totals"][item_name] = report["totals"].get(item_name, 0) + qty
 
     return report
+
+
+@snapshot_cached
 def get_cart_report_with_prices(order_id):
     """
     Returns a summary report from the cart table including prices:
     - For each user: items, quantities, total price per item
-    - Total quantities and total prices per item across all users
-    - Grand total
+    - Total per user, total per item and grand total, read from the
+      per-order aggregate tables instead of being summed here
+    Users are keyed by id (two people may share a name); "names" maps
+    them to their current fullname.
     Output format:
     {
         "users": {
-            user_fullname: {item_name: {"quantity": x, "total_price": y}, ...},
+            user_id: {item_name: {"quantity": x, "total_price": y}, ...},
+            ...
+        },
+        "names": {user_id: fullname, ...},
+        "user_totals": {
+            user_id: total_price,
             ...
         },
         "totals": {
@@ -267,40 +822,198 @@ def get_cart_report_with_prices(order_id):
         "grand_total": total_amount
     }
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # گرفتن همه آیتم‌ها و تعداد هر کاربر و قیمت منو
-    cursor.execute("""
-        SELECT u.fullname, m.name, c.quantity, m.price
-        FROM cart c
-        JOIN users u ON c.user_id = u.id
-        JOIN menus m ON c.menu_id = m.id
-        WHERE c.order_id = ?
-    """, (order_id,))
-    rows = cursor.fetchall()
-    conn.close()
-
-    report = {"users": {}, "totals": {}, "grand_total": 0}
-
-    for fullname, item_name, qty, price in rows:
-        item_total = qty * price
+    with snapshot() as conn:
+        cursor = conn.cursor()
+
+        # گرفتن همه آیتم‌ها و تعداد هر کاربر و قیمت منو
+        cursor.execute("""
+            SELECT c.user_id, m.name, c.quantity, m.price
+            FROM cart c
+            JOIN menus m ON c.menu_id = m.id
+            WHERE c.order_id = ?
+        """, (order_id,))
+        rows = cursor.fetchall()
+
+        cursor.execute("SELECT user_id, total_price FROM order_user_totals WHERE order_id = ?", (order_id,))
+        user_totals = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT m.name, t.quantity, t.total_price
+            FROM order_item_totals t
+            JOIN menus m ON t.menu_id = m.id
+            WHERE t.order_id = ?
+        """, (order_id,))
+        totals = cursor.fetchall()
+
+        cursor.execute("SELECT total_price FROM order_totals WHERE order_id = ?", (order_id,))
+        grand_row = cursor.fetchone()
+
+        report = {"users": {}, "names": {}, "user_totals": {}, "totals": {},
+                  "grand_total": grand_row[0] if grand_row else 0}
 
         # کاربران
-        if fullname not in report["users"]:
-            report["users"][fullname] = {}
-        report["users"][fullname][item_name] = {
-            "quantity": qty,
-            "total_price": item_total
-        }
-
-        # مجموع کل آیتم
+        for user_id, item_name, qty, price in rows:
+            report["users"].setdefault(user_id, {})[item_name] = {
+                "quantity": qty,
+                "total_price": qty * price
+            }
+        report["names"] = user_names(conn, list(report["users"]))
+
+    for user_id, total_price in user_totals:
+        report["user_totals"][user_id] = total_price
+
+    # مجموع کل آیتم
+    for item_name, qty, total_price in totals:
         if item_name not in report["totals"]:
             report["totals"][item_name] = {"quantity": 0, "total_price": 0}
         report["totals"][item_name]["quantity"] += qty
-        report["totals"][item_name]["total_price"] += item_total
+        report["totals"][item_name]["total_price"] += total_price
+
+    return report
+
+
+@snapshot_cached
+def get_order_items_report(order_id):
+    """
+    Same shape as get_cart_report_with_prices, but read from the finalized
+    order_items instead of the live carts (used by /export).
+    """
+    with snapshot() as conn:
+        report = _order_items_report(conn, order_id)
+        report["names"] = user_names(conn, list(report["users"]))
+    return report
+
 
-        # جمع کل نهایی
-        report["grand_total"] += item_total
+def _order_items_report(conn, order_id):
+    cursor = conn.execute("""
+        SELECT oi.user_id, m.name, oi.quantity, m.price
+        FROM order_items oi
+        JOIN menus m ON oi.menu_id = m.id
+        WHERE oi.order_id = ?
+        ORDER BY oi.user_id, oi.menu_id
+    """, (order_id,))
 
+    report = {"users": {}, "names": {}, "user_totals": {}, "totals": {}, "grand_total": 0}
+    for user_id, item_name, qty, price in cursor.fetchall():
+        total_price = qty * price
+        items = report["users"].setdefault(user_id, {})
+        item = items.setdefault(item_name, {"quantity": 0, "total_price": 0})
+        item["quantity"] += qty
+        item["total_price"] += total_price
+
+        report["user_totals"][user_id] = report["user_totals"].get(user_id, 0) + total_price
+        totals = report["totals"].setdefault(item_name, {"quantity": 0, "total_price": 0})
+        totals["quantity"] += qty
+        totals["total_price"] += total_price
+        report["grand_total"] += total_price
     return report
+
+
+# ------------------------------
+# Archive
+# ------------------------------
+# (table, columns copied, order id column); the archive has the same columns
+ARCHIVED_TABLES = (
+    ("orders_table", "id, title, created_by, created_at, status, closes_at, closed_at", "id"),
+    ("menus", "id, order_id, name, price", "order_id"),
+    ("order_items", "id, user_id, menu_id, order_id, quantity, status, finalized_at", "order_id"),
+    ("cart", "user_id, order_id, menu_id, quantity", "order_id"),
+    ("order_snapshots", "order_id, kind, data, created_at", "order_id"),
+)
+
+
+def _open_archive():
+    """
+    Connection with the archive file as main and the hot file attached as "hot".
+    """
+    conn = sqlite3.connect(ARCHIVE_PATH, timeout=DB_BUSY_TIMEOUT, isolation_level=None,
+                           factory=InstrumentedConnection)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        # the archive copy must be on disk before the hot rows are gone
+        conn.execute("PRAGMA synchronous=FULL")
+        migrate(conn, ARCHIVE_MIGRATIONS_DIR)
+        conn.execute("ATTACH DATABASE ? AS hot", (DB_PATH,))
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def archive_orders(order_ids=None, older_than_days=None):
+    """
+    Move orders with their menus, carts and finalized items to the archive
+    file, then return the freed pages of the hot file with incremental
+    VACUUM. Archives the given order_ids, or every order created more than
+    older_than_days ago. Returns the archived ids.
+
+    Copy and delete run in one BEGIN IMMEDIATE transaction over both files.
+    The archive is the connection's main database, so SQLite commits it
+    first: a crash in between leaves an order in both files, and the next
+    run copies it again.
+    """
+    conn = _open_archive()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TEMP TABLE archiving (id INTEGER PRIMARY KEY)")
+            if order_ids is None:
+                conn.execute("""
+                    INSERT INTO temp.archiving SELECT id FROM hot.orders_table
+                    WHERE created_at < datetime('now', ?)
+                """, (f"-{older_than_days} days",))
+            else:
+                conn.executemany("INSERT OR IGNORE INTO temp.archiving SELECT id FROM hot.orders_table WHERE id = ?",
+                                 [(order_id,) for order_id in order_ids])
+            archived = [row[0] for row in conn.execute("SELECT id FROM temp.archiving").fetchall()]
+
+            for table, columns, key in ARCHIVED_TABLES:
+                conn.execute(f"""
+                    INSERT OR REPLACE INTO main.{table} ({columns})
+                    SELECT {columns} FROM hot.{table} WHERE {key} IN (SELECT id FROM temp.archiving)
+                """)
+            # the order row first, or the cart_closed_* triggers would keep the carts of closed
+            # orders; cart before menus, its aggregate triggers still look up prices
+            for table, key in (("orders_table", "id"), ("cart", "order_id"), ("order_items", "order_id"),
+                               ("menus", "order_id"), ("order_snapshots", "order_id"),
+                               ("order_item_totals", "order_id"), ("order_user_totals", "order_id"),
+                               ("order_totals", "order_id")):
+                conn.execute(f"DELETE FROM hot.{table} WHERE {key} IN (SELECT id FROM temp.archiving)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.archiving")
+
+        if archived:
+            if conn.execute("PRAGMA hot.auto_vacuum").fetchone()[0] != 2:
+                # a file created without auto_vacuum needs one full VACUUM to switch
+                conn.execute("PRAGMA hot.auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM hot")
+            else:
+                conn.execute("PRAGMA hot.incremental_vacuum").fetchall()
+    finally:
+        conn.close()
+
+    for order_id in archived:
+        cache.menus.invalidate(order_id)
+        forget_reports(order_id)
+    return archived
+
+
+def get_archived_report(order_id):
+    """
+    (get_report, get_order_items_report) data of an archived order,
+    ([], None) when it is not in the archive.
+    """
+    if not os.path.exists(ARCHIVE_PATH):
+        return [], None
+    with snapshot(archive_pool) as conn:
+        report = _report(conn, order_id)
+        if not report:
+            return [], None
+        priced_report = _order_items_report(conn, order_id)
+    with snapshot() as conn:
+        priced_report["names"] = user_names(conn, list(priced_report["users"]))
+    return report, priced_report
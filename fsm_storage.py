@@ -0,0 +1,119 @@
+"""
+FSM storage kept in the bot's SQLite database.
+
+Reads are served from an in-memory LRU; changes are written through to
+the cache at once and to SQLite in batches after FSM_FLUSH_DELAY seconds
+(and on close), so a message never waits on a disk round trip.
+State untouched for FSM_TTL seconds is treated as abandoned and dropped.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+import async_db
+from cache import LRUCache
+from config import FSM_CACHE_SIZE, FSM_FLUSH_DELAY, FSM_TTL
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state=None, data=None, updated_at=0.0):
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+
+    def __init__(self, cache_size=FSM_CACHE_SIZE, ttl=FSM_TTL, flush_delay=FSM_FLUSH_DELAY):
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = LRUCache(cache_size)
+        self._dirty = {}   # key -> _Record waiting to be written
+        self._timer = None
+
+    async def set_state(self, key, state=None):
+        k = self.key_builder.build(key)
+        record = await self._record(k)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(k, record)
+
+    async def get_state(self, key):
+        return (await self._record(self.key_builder.build(key))).state
+
+    async def set_data(self, key, data):
+        k = self.key_builder.build(key)
+        record = await self._record(k)
+        record.data = dict(data)
+        self._touch(k, record)
+
+    async def get_data(self, key):
+        return (await self._record(self.key_builder.build(key))).data.copy()
+
+    async def close(self):
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        rows = [(k, r.state, json.dumps(r.data), r.updated_at) for k, r in batch.items()]
+        try:
+            await async_db.save_fsm_states(rows)
+        except Exception:
+            for k, r in batch.items():
+                self._dirty.setdefault(k, r)
+            self._schedule()
+            raise
+
+    async def purge(self):
+        """
+        Delete expired state from the database.
+        """
+        await self.flush()
+        return await async_db.purge_fsm_states(time.time() - self.ttl)
+
+    async def _record(self, k):
+        record = self._dirty.get(k) or self._cache.get(k)
+        if record is None:
+            row = await async_db.load_fsm_state(k)
+            # ممکن است در حین خواندن، درخواست دیگری رکورد را ساخته باشد
+            record = self._dirty.get(k) or self._cache.get(k)
+            if record is None:
+                record = _Record(row[0], json.loads(row[1]), row[2]) if row else _Record()
+                self._cache.set(k, record)
+
+        if record.updated_at and time.time() - record.updated_at > self.ttl:
+            # رها شده؛ از اول شروع می‌شود
+            record.state, record.data = None, {}
+            self._touch(k, record)
+        return record
+
+    def _touch(self, k, record):
+        record.updated_at = time.time()
+        self._dirty[k] = record
+        self._schedule()
+
+    def _schedule(self):
+        if self._timer is None and self._dirty:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        task.add_done_callback(_log_failure)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception():
+        logging.error("FSM state flush failed", exc_info=task.exception())
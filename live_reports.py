@@ -0,0 +1,128 @@
+"""
+Admin overview / invoice messages that follow the carts.
+
+Opening a report page subscribes that message. Cart writes publish
+(order_id, delta) on pubsub.cart_changes; each subscribed message of the
+order is then re-rendered at most once every LIVE_REPORT_INTERVAL seconds,
+and edit_message skips the edit when the page did not change. A message
+stops following once it shows something else or after LIVE_REPORT_TTL.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+
+import async_db
+import pubsub
+from config import LIVE_REPORT_INTERVAL, LIVE_REPORT_TTL
+
+MAX_SUBSCRIPTIONS = 256
+
+
+class Subscription:
+    __slots__ = ("message", "kind", "order_id", "page", "expires", "edited_at", "changed_at", "timer")
+
+    def __init__(self, message, kind, order_id, page):
+        self.message = message
+        self.kind = kind
+        self.order_id = order_id
+        self.page = page
+        self.expires = time.monotonic() + LIVE_REPORT_TTL
+        self.edited_at = time.monotonic()
+        self.changed_at = 0.0
+        self.timer = None
+
+
+class LiveReports:
+
+    def __init__(self, refresh, interval=LIVE_REPORT_INTERVAL):
+        """
+        refresh: coroutine(subscription) that re-renders and edits the message.
+        """
+        self.refresh = refresh
+        self.interval = interval
+        self._subs = {}       # (chat_id, message_id) -> Subscription
+        self._by_order = {}   # order_id -> {key, ...}
+        self._loop = None
+
+    def start(self):
+        if not self.interval:
+            return
+        self._loop = asyncio.get_running_loop()
+        pubsub.cart_changes.subscribe(self._on_change)
+
+    def stop(self):
+        pubsub.cart_changes.unsubscribe(self._on_change)
+        for key in list(self._subs):
+            self._drop(key)
+
+    def watch(self, message, kind, order_id, page):
+        if self._loop is None:
+            return
+        key = (message.chat.id, message.message_id)
+        self._drop(key)
+        while len(self._subs) >= MAX_SUBSCRIPTIONS:
+            self._drop(next(iter(self._subs)))
+        self._subs[key] = Subscription(message, kind, order_id, page)
+        self._by_order.setdefault(order_id, set()).add(key)
+
+    def unwatch(self, message):
+        self._drop((message.chat.id, message.message_id))
+
+    def _drop(self, key):
+        sub = self._subs.pop(key, None)
+        if sub is None:
+            return
+        if sub.timer is not None:
+            sub.timer.cancel()
+        keys = self._by_order.get(sub.order_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_order[sub.order_id]
+
+    def _on_change(self, order_id, delta):
+        # روی ترد نویسنده دیتابیس اجرا می‌شود
+        if order_id in self._by_order:
+            self._loop.call_soon_threadsafe(self._changed, order_id)
+
+    def _changed(self, order_id):
+        now = time.monotonic()
+        for key in list(self._by_order.get(order_id, ())):
+            sub = self._subs[key]
+            if now > sub.expires:
+                self._drop(key)
+                continue
+            sub.changed_at = now
+            if sub.timer is None:
+                self._schedule(key, sub, max(0.0, sub.edited_at + self.interval - now))
+
+    def _fire(self, key):
+        sub = self._subs.get(key)
+        if sub is not None:
+            asyncio.ensure_future(self._refresh(key, sub))
+
+    async def _refresh(self, key, sub):
+        started = time.monotonic()
+        try:
+            await self.refresh(sub)
+        except TelegramBadRequest as e:
+            # پیام پاک شده یا دیگر قابل ویرایش نیست
+            logging.info("Live report %s dropped: %s", key, e)
+            return self._drop(key)
+        except Exception:
+            logging.exception("Live report %s refresh failed", key)
+        now = sub.edited_at = time.monotonic()
+        sub.timer = None
+        if self._subs.get(key) is not sub:
+            return
+        if sub.changed_at >= started:
+            self._schedule(key, sub, self.interval)
+        elif sub.changed_at > started - async_db.report_max_age:
+            # the report may have come from db's snapshot cache and predate
+            # the last change: one more pass once that entry has expired
+            self._schedule(key, sub, max(self.interval, sub.changed_at + async_db.report_max_age - now))
+
+    def _schedule(self, key, sub, delay):
+        sub.timer = self._loop.call_later(delay, self._fire, key)
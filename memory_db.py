@@ -0,0 +1,445 @@
+"""
+In-memory storage engine with the same functions as db.py.
+
+Plain dicts plus the few indexes the handlers need (menus by order, carts
+by user and by order). Nothing is persisted and nothing is shared between
+processes, so it is meant for benchmarks and quick local runs:
+
+    DB_ENGINE=memory python bot.py
+"""
+import string
+import threading
+import time
+from collections import defaultdict
+
+import cache
+import pubsub
+from db import OrderClosed
+from config import ORDERS_PAGE_SIZE
+
+_lock = threading.RLock()
+
+users = {}                     # user_id -> (id, fullname, username)
+orders = {}                    # order_id -> (id, title, created_by)
+menus = {}                     # menu_id -> (id, order_id, name, price)
+menus_by_order = defaultdict(list)   # order_id -> [menu_id, ...]
+carts = defaultdict(dict)      # (user_id, order_id) -> {menu_id: quantity}
+cart_users = defaultdict(dict)       # order_id -> {user_id: None}, in insertion order
+order_items = defaultdict(dict)      # order_id -> {(user_id, menu_id): quantity}
+fsm_states = {}                # key -> (state, data JSON, updated_at)
+created_at = {}                # order_id -> time.time() at creation
+lifecycle = {}                 # order_id -> (status, closes_at)
+snapshots = defaultdict(dict)  # order_id -> {kind: bytes}, kept when the order is archived
+archived = {}                  # order_id -> (get_report, get_order_items_report) at archive time
+_ids = {"orders": 0, "menus": 0}
+
+# LIKE در SQLite فقط حروف ASCII را بدون حساسیت به بزرگی مقایسه می‌کند
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def init_db():
+    pass
+
+
+def reset():
+    """
+    Drop everything (between benchmark runs).
+    """
+    with _lock:
+        for table in (users, orders, menus, menus_by_order, carts, cart_users, order_items, fsm_states,
+                      created_at, archived, lifecycle, snapshots):
+            table.clear()
+        _ids.update(orders=0, menus=0)
+    cache.menus.clear()
+
+
+# ------------------------------
+# User functions
+# ------------------------------
+def add_user(user_id, fullname, username):
+    with _lock:
+        users[user_id] = (user_id, fullname, username)
+
+
+def get_user(user_id):
+    return users.get(user_id)
+
+
+def update_user_name(user_id, new_name):
+    with _lock:
+        user = users.get(user_id)
+        if user:
+            users[user_id] = (user_id, new_name, user[2])
+
+
+# ------------------------------
+# Order functions
+# ------------------------------
+def create_order(title, created_by):
+    with _lock:
+        _ids["orders"] += 1
+        order_id = _ids["orders"]
+        orders[order_id] = (order_id, title, created_by)
+        created_at[order_id] = time.time()
+        lifecycle[order_id] = ("open", None)
+    cache.menus.invalidate(order_id)
+    return order_id
+
+
+def get_order(order_id):
+    return orders.get(order_id)
+
+
+def get_orders_page(before_id=None, after_id=None, prefix=None, limit=ORDERS_PAGE_SIZE):
+    with _lock:
+        ids = sorted(orders, reverse=after_id is None)
+        rows = []
+        for order_id in ids:
+            if before_id is not None and order_id >= before_id:
+                continue
+            if after_id is not None and order_id <= after_id:
+                continue
+            title = orders[order_id][1]
+            if prefix and not title.translate(_ASCII_LOWER).startswith(prefix.translate(_ASCII_LOWER)):
+                continue
+            rows.append((order_id, title))
+            if len(rows) > limit:
+                break
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is not None:
+        rows.reverse()
+        return rows, True, more
+    return rows, more, before_id is not None
+
+
+def add_menu(order_id, name, price):
+    with _lock:
+        _ids["menus"] += 1
+        menu_id = _ids["menus"]
+        menus[menu_id] = (menu_id, order_id, name, price)
+        menus_by_order[order_id].append(menu_id)
+    cache.menus.invalidate(order_id)
+
+
+def add_menus(order_id, items):
+    with _lock:
+        for name, price in items:
+            _ids["menus"] += 1
+            menus[_ids["menus"]] = (_ids["menus"], order_id, name, price)
+            menus_by_order[order_id].append(_ids["menus"])
+    cache.menus.invalidate(order_id)
+    return len(items)
+
+
+def get_menus(order_id):
+    return get_order_menu(order_id).menus
+
+
+def get_order_menu(order_id):
+    entry = cache.menus.get(order_id)
+    if entry is None:
+        version = cache.menus.version
+        with _lock:
+            order = orders.get(order_id)
+            rows = [menus[mid][:1] + menus[mid][2:] for mid in menus_by_order.get(order_id, ())]
+            status, closes_at = lifecycle.get(order_id, (None, None))
+        entry = cache.OrderMenu(order_id, order[1] if order else None, rows, status, closes_at)
+        cache.menus.set(order_id, entry, version)
+    return entry
+
+
+def get_menu_screen(user_id, order_id):
+    entry = get_order_menu(order_id)
+    return entry, dict(carts.get((user_id, order_id), ()))
+
+
+def get_item_screen(user_id, order_id, menu_id):
+    item = cache.menus.item(menu_id) or get_order_menu(order_id).items.get(menu_id)
+    return item, get_cart_quantity(user_id, order_id, menu_id)
+
+
+# ------------------------------
+# Cart functions
+# ------------------------------
+def _closed(order_id):
+    return lifecycle.get(order_id, (None,))[0] == "closed"
+
+
+def _set_quantity(user_id, order_id, menu_id, quantity):
+    key = (user_id, order_id)
+    if quantity > 0:
+        if menu_id not in menus:
+            raise ValueError(f"Unknown menu item {menu_id}")
+        carts[key][menu_id] = quantity
+        cart_users[order_id].setdefault(user_id)
+        return quantity
+
+    cart = carts.get(key)
+    if cart is not None:
+        cart.pop(menu_id, None)
+        if not cart:
+            del carts[key]
+            cart_users[order_id].pop(user_id, None)
+    return 0
+
+
+def update_cart(user_id, order_id, menu_id, qty_change):
+    with _lock:
+        if _closed(order_id):
+            raise OrderClosed(order_id)
+        quantity = carts.get((user_id, order_id), {}).get(menu_id, 0)
+        quantity = _set_quantity(user_id, order_id, menu_id, quantity + qty_change)
+    pubsub.cart_changes.publish(order_id, ((user_id, menu_id, quantity),))
+    return quantity
+
+
+def set_cart_quantities(rows):
+    with _lock:
+        for user_id, order_id, menu_id, quantity in rows:
+            # like the cart_closed_* triggers: rows of closed orders are skipped
+            if not _closed(order_id):
+                _set_quantity(user_id, order_id, menu_id, quantity)
+    pubsub.publish_cart_rows(rows)
+
+
+def get_cart(user_id, order_id):
+    with _lock:
+        return [(mid, menus[mid][2], menus[mid][3], qty)
+                for mid, qty in carts.get((user_id, order_id), {}).items()]
+
+
+def get_cart_quantity(user_id, order_id, menu_id):
+    return carts.get((user_id, order_id), {}).get(menu_id, 0)
+
+
+def clear_cart(user_id, order_id):
+    with _lock:
+        if _closed(order_id):
+            return
+        carts.pop((user_id, order_id), None)
+        cart_users[order_id].pop(user_id, None)
+    pubsub.cart_changes.publish(order_id, ((user_id, None, 0),))
+
+
+# ------------------------------
+# Order finalization
+# ------------------------------
+def add_order(user_id, order_id, menu_id, quantity):
+    with _lock:
+        items = order_items[order_id]
+        items[(user_id, menu_id)] = items.get((user_id, menu_id), 0) + quantity
+
+
+def finalize_cart(user_id, order_id):
+    with _lock:
+        items = order_items[order_id]
+        for key in [key for key in items if key[0] == user_id]:
+            del items[key]
+        cart = carts.get((user_id, order_id), {})
+        for menu_id, quantity in cart.items():
+            items[(user_id, menu_id)] = quantity
+        return len(cart)
+
+
+def finalize_order(order_id):
+    with _lock:
+        items = order_items[order_id] = {}
+        for user_id in cart_users.get(order_id, ()):
+            for menu_id, quantity in carts[(user_id, order_id)].items():
+                items[(user_id, menu_id)] = quantity
+        return len({user_id for user_id, _ in items}), len(items)
+
+
+# ------------------------------
+# Order lifecycle
+# ------------------------------
+def close_order(order_id):
+    with _lock:
+        if lifecycle.get(order_id, (None,))[0] != "open":
+            return None
+        lifecycle[order_id] = ("closed", lifecycle[order_id][1])
+        result = finalize_order(order_id)
+    cache.menus.invalidate(order_id)
+    return result
+
+
+def reopen_order(order_id):
+    with _lock:
+        if not _closed(order_id):
+            return False
+        lifecycle[order_id] = ("open", None)
+        snapshots.pop(order_id, None)
+    cache.menus.invalidate(order_id)
+    return True
+
+
+def set_order_cutoff(order_id, closes_at):
+    with _lock:
+        updated = lifecycle.get(order_id, (None,))[0] == "open"
+        if updated:
+            lifecycle[order_id] = ("open", closes_at)
+    cache.menus.invalidate(order_id)
+    return updated
+
+
+def get_order_cutoffs():
+    with _lock:
+        return [(order_id, closes_at) for order_id, (status, closes_at) in lifecycle.items()
+                if status == "open" and closes_at is not None]
+
+
+def save_order_snapshots(order_id, data):
+    with _lock:
+        if _closed(order_id):
+            snapshots[order_id].update(data)
+
+
+def get_order_snapshot(order_id, kind):
+    return snapshots.get(order_id, {}).get(kind)
+
+
+# ------------------------------
+# FSM storage
+# ------------------------------
+def load_fsm_state(key):
+    return fsm_states.get(key)
+
+
+def save_fsm_states(rows):
+    with _lock:
+        for key, state, data, updated_at in rows:
+            if state is None and data == "{}":
+                fsm_states.pop(key, None)
+            else:
+                fsm_states[key] = (state, data, updated_at)
+
+
+def purge_fsm_states(before):
+    with _lock:
+        expired = [key for key, row in fsm_states.items() if row[2] < before]
+        for key in expired:
+            del fsm_states[key]
+    return len(expired)
+
+
+# ------------------------------
+# Report
+# ------------------------------
+def _cart_rows(order_id):
+    """
+    (user_id, menu_id, quantity) of every cart in the order.
+    """
+    return [(user_id, menu_id, quantity)
+            for user_id in cart_users.get(order_id, ())
+            for menu_id, quantity in carts[(user_id, order_id)].items()]
+
+
+def get_report(order_id):
+    with _lock:
+        totals = {}
+        for (_, menu_id), quantity in order_items.get(order_id, {}).items():
+            totals[menu_id] = totals.get(menu_id, 0) + quantity
+        return [(menus[mid][2], qty, qty * menus[mid][3]) for mid, qty in sorted(totals.items())]
+
+
+def _item_totals(rows):
+    """
+    {menu_id: quantity} summed over cart rows, ordered by menu_id like the
+    order_item_totals table.
+    """
+    totals = {}
+    for _, menu_id, qty in rows:
+        totals[menu_id] = totals.get(menu_id, 0) + qty
+    return dict(sorted(totals.items()))
+
+
+def _names(user_ids):
+    return {user_id: users[user_id][1] for user_id in user_ids if user_id in users}
+
+
+def get_cart_report_summary(order_id):
+    report = {"users": {}, "names": {}, "totals": {}}
+    with _lock:
+        rows = _cart_rows(order_id)
+        for user_id, menu_id, qty in rows:
+            items = report["users"].setdefault(user_id, {})
+            item_name = menus[menu_id][2]
+            items[item_name] = items.get(item_name, 0) + qty
+        for menu_id, qty in _item_totals(rows).items():
+            item_name = menus[menu_id][2]
+            report["totals"][item_name] = report["totals"].get(item_name, 0) + qty
+        report["names"] = _names(report["users"])
+    return report
+
+
+def get_cart_report_with_prices(order_id):
+    report = {"users": {}, "names": {}, "user_totals": {}, "totals": {}, "grand_total": 0}
+    user_totals = {}
+    with _lock:
+        rows = _cart_rows(order_id)
+        for user_id, menu_id, qty in rows:
+            _, _, item_name, price = menus[menu_id]
+            user_totals[user_id] = user_totals.get(user_id, 0) + qty * price
+            report["users"].setdefault(user_id, {})[item_name] = {
+                "quantity": qty,
+                "total_price": qty * price,
+            }
+
+        for user_id in sorted(user_totals):
+            report["user_totals"][user_id] = user_totals[user_id]
+
+        for menu_id, qty in _item_totals(rows).items():
+            _, _, item_name, price = menus[menu_id]
+            totals = report["totals"].setdefault(item_name, {"quantity": 0, "total_price": 0})
+            totals["quantity"] += qty
+            totals["total_price"] += qty * price
+            report["grand_total"] += qty * price
+        report["names"] = _names(report["users"])
+    return report
+
+
+def get_order_items_report(order_id):
+    report = {"users": {}, "names": {}, "user_totals": {}, "totals": {}, "grand_total": 0}
+    with _lock:
+        for (user_id, menu_id), qty in sorted(order_items.get(order_id, {}).items()):
+            _, _, item_name, price = menus[menu_id]
+            total_price = qty * price
+            item = report["users"].setdefault(user_id, {}).setdefault(item_name, {"quantity": 0, "total_price": 0})
+            item["quantity"] += qty
+            item["total_price"] += total_price
+
+            report["user_totals"][user_id] = report["user_totals"].get(user_id, 0) + total_price
+            totals = report["totals"].setdefault(item_name, {"quantity": 0, "total_price": 0})
+            totals["quantity"] += qty
+            totals["total_price"] += total_price
+            report["grand_total"] += total_price
+        report["names"] = _names(report["users"])
+    return report
+
+
+# ------------------------------
+# Archive
+# ------------------------------
+def archive_orders(order_ids=None, older_than_days=None):
+    with _lock:
+        if order_ids is None:
+            cutoff = time.time() - older_than_days * 86400
+            order_ids = [order_id for order_id, created in created_at.items() if created < cutoff]
+        ids = [order_id for order_id in dict.fromkeys(order_ids) if order_id in orders]
+        for order_id in ids:
+            archived[order_id] = (get_report(order_id), get_order_items_report(order_id))
+            for user_id in cart_users.pop(order_id, ()):
+                del carts[(user_id, order_id)]
+            for menu_id in menus_by_order.pop(order_id, ()):
+                del menus[menu_id]
+            order_items.pop(order_id, None)
+            del orders[order_id], created_at[order_id], lifecycle[order_id]
+    for order_id in ids:
+        cache.menus.invalidate(order_id)
+    return ids
+
+
+def get_archived_report(order_id):
+    report, priced_report = archived.get(order_id, ([], None))
+    return (report, priced_report) if report else ([], None)
@@ -0,0 +1,211 @@
+"""
+Handler and SQL metrics, served as Prometheus text on a local endpoint.
+
+HandlerMetrics is an aiogram middleware recording latency and errors per
+handler, labelled with the name of the handler function that took the
+update; updates no handler took are counted as "other", so whatever users
+type cannot add labels. When the endpoint is enabled, install() also hooks
+db so every query is timed and its rows counted, one series per statement
+shape (IN (?, ?, ...) lists collapsed); queries slower than SLOW_QUERY_MS
+are logged.
+"""
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiohttp import web
+
+import async_db
+import db
+from config import METRICS_HOST, METRICS_PORT, SLOW_QUERY_MS
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger("foodbot.slow_query")
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Registry:
+
+    def __init__(self):
+        self.handlers = {}   # (bot, handler) -> Histogram
+        self.errors = {}     # (bot, handler) -> count
+        self.queries = {}    # query label -> [calls, seconds, rows]
+        self._lock = threading.Lock()
+
+    def observe_handler(self, bot, handler, seconds, failed):
+        key = (bot, handler)
+        histogram = self.handlers.get(key)
+        if histogram is None:
+            histogram = self.handlers[key] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_query(self, sql, seconds, rows, call):
+        # از تردهای دیتابیس صدا زده می‌شود
+        with self._lock:
+            label = query_label(sql)
+            stats = self.queries.get(label)
+            if stats is None:
+                stats = self.queries[label] = [0, 0.0, 0]
+            stats[0] += call
+            stats[1] += seconds
+            stats[2] += rows
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            slow_log.warning("%.1f ms (%d rows): %s", seconds * 1000, rows, _compact(sql))
+
+    def render(self):
+        lines = [
+            "# HELP foodbot_handler_seconds Handler latency.",
+            "# TYPE foodbot_handler_seconds histogram",
+        ]
+        for (bot, handler), h in sorted(self.handlers.items()):
+            labels = f'bot="{bot}",handler="{_escape(handler)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), h.counts):
+                cumulative += count
+                lines.append(f'foodbot_handler_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"foodbot_handler_seconds_sum{{{labels}}} {h.sum:.6f}")
+            lines.append(f"foodbot_handler_seconds_count{{{labels}}} {h.count}")
+
+        lines += ["# HELP foodbot_handler_errors_total Handler exceptions.",
+                  "# TYPE foodbot_handler_errors_total counter"]
+        for (bot, handler), count in sorted(self.errors.items()):
+            lines.append(f'foodbot_handler_errors_total{{bot="{bot}",handler="{_escape(handler)}"}} {count}')
+
+        with self._lock:
+            queries = sorted((label, list(stats)) for label, stats in self.queries.items())
+        for name, kind, index, help_text in (
+            ("foodbot_sql_calls_total", "counter", 0, "Statements executed."),
+            ("foodbot_sql_seconds_total", "counter", 1, "Time spent executing and fetching."),
+            ("foodbot_sql_rows_total", "counter", 2, "Rows returned or changed."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for sql, stats in queries:
+                lines.append(f'{name}{{query="{_escape(sql)}"}} {stats[index]}')
+
+        lines += [
+            "# TYPE foodbot_db_pool_waits_total counter",
+            f"foodbot_db_pool_waits_total {db.pool.waits}",
+            "# TYPE foodbot_db_pool_wait_seconds_total counter",
+            f"foodbot_db_pool_wait_seconds_total {db.pool.wait_seconds:.6f}",
+            "# TYPE foodbot_db_writes_total counter",
+            f"foodbot_db_writes_total {async_db.writer_stats['writes']}",
+            "# TYPE foodbot_db_writer_wait_seconds_total counter",
+            f"foodbot_db_writer_wait_seconds_total {async_db.writer_stats['wait_seconds']:.6f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _compact(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+@functools.lru_cache(maxsize=1024)
+def query_label(sql):
+    """
+    One label per statement shape: whitespace compacted, IN (?, ?, ...) lists
+    of any length collapsed to IN (...).
+    """
+    label = re.sub(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", "IN (...)", _compact(sql), flags=re.IGNORECASE)
+    return label[:120]
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# ------------------------------
+# aiogram middleware
+# ------------------------------
+class HandlerMetrics(BaseMiddleware):
+    """
+    Outer middleware for dp.message / dp.callback_query. It cannot see which
+    handler matched, so MatchedHandler (inner) writes the name into a list
+    shared through data.
+    """
+
+    def __init__(self, bot_name):
+        self.bot_name = bot_name
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        failed = False
+        result = None
+        matched = data["metrics_handler"] = []
+        try:
+            result = await handler(event, data)
+            return result
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # SkipHandler may pass the update on; the last match took it
+            name = matched[-1] if matched and (failed or result is not UNHANDLED) else "other"
+            registry.observe_handler(self.bot_name, name, time.perf_counter() - started, failed)
+
+
+class MatchedHandler(BaseMiddleware):
+    """
+    Inner middleware: records the name of the handler whose filters passed.
+    """
+
+    async def __call__(self, handler, event, data):
+        matched = data.get("metrics_handler")
+        if matched is not None:
+            callback = data["handler"].callback
+            matched.append(getattr(callback, "__name__", type(callback).__name__))
+        return await handler(event, data)
+
+
+def install(dp, bot_name):
+    middleware = HandlerMetrics(bot_name)
+    matched = MatchedHandler()
+    for observer in (dp.message, dp.callback_query):
+        observer.outer_middleware(middleware)
+        observer.middleware(matched)
+    if METRICS_PORT or SLOW_QUERY_MS:
+        db.set_query_hook(registry.observe_query)
+
+
+# ------------------------------
+# /metrics endpoint
+# ------------------------------
+async def metrics_handler(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Start the local endpoint; returns the runner (None when disabled).
+    """
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,4 +1,4 @@
--- Orders table (formerly campaigns)
+-- Base schema: orders, their menus, users, finalized items and live carts
 CREATE TABLE IF NOT EXISTS orders_table (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     title TEXT NOT NULL,
@@ -6,7 +6,6 @@ CREATE TABLE IF NOT EXISTS orders_table (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Menus belong to an order
 CREATE TABLE IF NOT EXISTS menus (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     order_id INTEGER NOT NULL,
@@ -15,14 +14,12 @@ CREATE TABLE IF NOT EXISTS menus (
     FOREIGN KEY(order_id) REFERENCES orders_table(id)
 );
 
--- Users table
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY,
-    fullname TEXT,
+    fullname TEXT NOT NULL,
     username TEXT
 );
 
--- Order items linked to order and menu
 CREATE TABLE IF NOT EXISTS order_items (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -35,11 +32,10 @@ CREATE TABLE IF NOT EXISTS order_items (
     FOREIGN KEY(order_id) REFERENCES orders_table(id)
 );
 
--- Cart linked to order
 CREATE TABLE IF NOT EXISTS cart (
     user_id INTEGER,
     order_id INTEGER,
     menu_id INTEGER,
     quantity INTEGER DEFAULT 0,
     PRIMARY KEY (user_id, order_id, menu_id)
-);
\ No newline at end of file
+);
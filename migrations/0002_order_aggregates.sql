@@ -0,0 +1,94 @@
+-- Per-order totals kept current by triggers on cart, then backfilled from cart
+CREATE TABLE IF NOT EXISTS order_item_totals (
+    order_id INTEGER NOT NULL,
+    menu_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    total_price INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (order_id, menu_id)
+);
+
+CREATE TABLE IF NOT EXISTS order_user_totals (
+    order_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    total_price INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (order_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS order_totals (
+    order_id INTEGER PRIMARY KEY,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    total_price INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS cart_totals_insert AFTER INSERT ON cart
+BEGIN
+    INSERT INTO order_item_totals (order_id, menu_id, quantity, total_price)
+    VALUES (NEW.order_id, NEW.menu_id, NEW.quantity, NEW.quantity * (SELECT price FROM menus WHERE id = NEW.menu_id))
+    ON CONFLICT(order_id, menu_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    INSERT INTO order_user_totals (order_id, user_id, quantity, total_price)
+    VALUES (NEW.order_id, NEW.user_id, NEW.quantity, NEW.quantity * (SELECT price FROM menus WHERE id = NEW.menu_id))
+    ON CONFLICT(order_id, user_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    INSERT INTO order_totals (order_id, quantity, total_price)
+    VALUES (NEW.order_id, NEW.quantity, NEW.quantity * (SELECT price FROM menus WHERE id = NEW.menu_id))
+    ON CONFLICT(order_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cart_totals_update AFTER UPDATE OF quantity ON cart
+BEGIN
+    INSERT INTO order_item_totals (order_id, menu_id, quantity, total_price)
+    VALUES (NEW.order_id, NEW.menu_id, (NEW.quantity - OLD.quantity), (NEW.quantity - OLD.quantity) * (SELECT price FROM menus WHERE id = NEW.menu_id))
+    ON CONFLICT(order_id, menu_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    INSERT INTO order_user_totals (order_id, user_id, quantity, total_price)
+    VALUES (NEW.order_id, NEW.user_id, (NEW.quantity - OLD.quantity), (NEW.quantity - OLD.quantity) * (SELECT price FROM menus WHERE id = NEW.menu_id))
+    ON CONFLICT(order_id, user_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    INSERT INTO order_totals (order_id, quantity, total_price)
+    VALUES (NEW.order_id, (NEW.quantity - OLD.quantity), (NEW.quantity - OLD.quantity) * (SELECT price FROM menus WHERE id = NEW.menu_id))
+    ON CONFLICT(order_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    DELETE FROM order_item_totals WHERE order_id = NEW.order_id AND menu_id = NEW.menu_id AND quantity = 0;
+    DELETE FROM order_user_totals WHERE order_id = NEW.order_id AND user_id = NEW.user_id AND quantity = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cart_totals_delete AFTER DELETE ON cart
+BEGIN
+    INSERT INTO order_item_totals (order_id, menu_id, quantity, total_price)
+    VALUES (OLD.order_id, OLD.menu_id, -OLD.quantity, -OLD.quantity * (SELECT price FROM menus WHERE id = OLD.menu_id))
+    ON CONFLICT(order_id, menu_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    INSERT INTO order_user_totals (order_id, user_id, quantity, total_price)
+    VALUES (OLD.order_id, OLD.user_id, -OLD.quantity, -OLD.quantity * (SELECT price FROM menus WHERE id = OLD.menu_id))
+    ON CONFLICT(order_id, user_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    INSERT INTO order_totals (order_id, quantity, total_price)
+    VALUES (OLD.order_id, -OLD.quantity, -OLD.quantity * (SELECT price FROM menus WHERE id = OLD.menu_id))
+    ON CONFLICT(order_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, total_price = total_price + excluded.total_price;
+    DELETE FROM order_item_totals WHERE order_id = OLD.order_id AND menu_id = OLD.menu_id AND quantity = 0;
+    DELETE FROM order_user_totals WHERE order_id = OLD.order_id AND user_id = OLD.user_id AND quantity = 0;
+END;
+
+-- Backfill
+DELETE FROM order_item_totals;
+DELETE FROM order_user_totals;
+DELETE FROM order_totals;
+
+INSERT INTO order_item_totals (order_id, menu_id, quantity, total_price)
+SELECT c.order_id, c.menu_id, SUM(c.quantity), SUM(c.quantity * m.price)
+FROM cart c JOIN menus m ON c.menu_id = m.id
+GROUP BY c.order_id, c.menu_id;
+
+INSERT INTO order_user_totals (order_id, user_id, quantity, total_price)
+SELECT c.order_id, c.user_id, SUM(c.quantity), SUM(c.quantity * m.price)
+FROM cart c JOIN menus m ON c.menu_id = m.id
+GROUP BY c.order_id, c.user_id;
+
+INSERT INTO order_totals (order_id, quantity, total_price)
+SELECT c.order_id, SUM(c.quantity), SUM(c.quantity * m.price)
+FROM cart c JOIN menus m ON c.menu_id = m.id
+GROUP BY c.order_id;
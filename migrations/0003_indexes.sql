@@ -0,0 +1,6 @@
+-- Secondary indexes for per-order lookups and reports
+CREATE INDEX IF NOT EXISTS idx_menus_order ON menus(order_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_user ON order_items(user_id);
+-- cart's primary key starts with user_id, so reports by order need their own index
+CREATE INDEX IF NOT EXISTS idx_cart_order ON cart(order_id);
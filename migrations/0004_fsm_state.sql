@@ -0,0 +1,9 @@
+-- Durable FSM state for both bots (fsm_storage.SQLiteStorage)
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at);
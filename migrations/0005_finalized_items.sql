@@ -0,0 +1,16 @@
+-- order_items holds one finalized row per (order, user, menu item)
+-- merge any duplicates left by the old row-by-row add_order first
+UPDATE order_items SET quantity = (
+    SELECT SUM(o.quantity) FROM order_items o
+    WHERE o.order_id = order_items.order_id AND o.user_id = order_items.user_id AND o.menu_id = order_items.menu_id
+)
+WHERE id IN (SELECT MIN(id) FROM order_items GROUP BY order_id, user_id, menu_id HAVING COUNT(*) > 1);
+
+DELETE FROM order_items
+WHERE id NOT IN (SELECT MIN(id) FROM order_items GROUP BY order_id, user_id, menu_id);
+
+ALTER TABLE order_items ADD COLUMN finalized_at TIMESTAMP;
+
+-- replaces idx_order_items_order for lookups by order and makes re-finalizing idempotent
+DROP INDEX IF EXISTS idx_order_items_order;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_order_items_unique ON order_items(order_id, user_id, menu_id);
@@ -0,0 +1,35 @@
+-- Order lifecycle: 'open' -> 'closed', optionally at a scheduled cutoff (closes_at, unix time)
+ALTER TABLE orders_table ADD COLUMN status TEXT NOT NULL DEFAULT 'open';
+ALTER TABLE orders_table ADD COLUMN closes_at REAL;
+ALTER TABLE orders_table ADD COLUMN closed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_orders_cutoff ON orders_table(closes_at) WHERE status = 'open' AND closes_at IS NOT NULL;
+
+-- Overview / invoice pages (JSON) and the XLSX export, rendered once when the order closes
+CREATE TABLE IF NOT EXISTS order_snapshots (
+    order_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (order_id, kind)
+);
+
+-- Carts of a closed order are frozen. Rows are skipped rather than failing the statement,
+-- so a batch flushed by a process that has not seen the close yet still commits the rest.
+CREATE TRIGGER IF NOT EXISTS cart_closed_insert BEFORE INSERT ON cart
+WHEN (SELECT status FROM orders_table WHERE id = NEW.order_id) = 'closed'
+BEGIN
+    SELECT RAISE(IGNORE);
+END;
+
+CREATE TRIGGER IF NOT EXISTS cart_closed_update BEFORE UPDATE ON cart
+WHEN (SELECT status FROM orders_table WHERE id = NEW.order_id) = 'closed'
+BEGIN
+    SELECT RAISE(IGNORE);
+END;
+
+CREATE TRIGGER IF NOT EXISTS cart_closed_delete BEFORE DELETE ON cart
+WHEN (SELECT status FROM orders_table WHERE id = OLD.order_id) = 'closed'
+BEGIN
+    SELECT RAISE(IGNORE);
+END;
@@ -0,0 +1,38 @@
+-- Archive database (ARCHIVE_DB_NAME): orders moved out of the hot file by db.archive_orders,
+-- same columns as the hot tables, keyed by the same ids
+CREATE TABLE IF NOT EXISTS orders_table (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_by INTEGER NOT NULL,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS menus (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    menu_id INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    status TEXT,
+    finalized_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS cart (
+    user_id INTEGER,
+    order_id INTEGER,
+    menu_id INTEGER,
+    quantity INTEGER,
+    PRIMARY KEY (user_id, order_id, menu_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_menus_order ON menus(order_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_order_items_unique ON order_items(order_id, user_id, menu_id);
+CREATE INDEX IF NOT EXISTS idx_cart_order ON cart(order_id);
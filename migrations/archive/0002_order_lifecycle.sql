@@ -0,0 +1,12 @@
+-- Lifecycle columns and snapshots of archived orders (see migrations/0006_order_lifecycle.sql)
+ALTER TABLE orders_table ADD COLUMN status TEXT;
+ALTER TABLE orders_table ADD COLUMN closes_at REAL;
+ALTER TABLE orders_table ADD COLUMN closed_at TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS order_snapshots (
+    order_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at TIMESTAMP,
+    PRIMARY KEY (order_id, kind)
+);
@@ -0,0 +1,50 @@
+"""
+In-process publish/subscribe.
+
+cart_changes is published by db.py / memory_db.py after every committed
+cart write as (order_id, delta), delta being ((user_id, menu_id, quantity), ...)
+with the new quantities; menu_id None means the user's whole cart was
+cleared. Subscribers run on the writing thread and must return quickly.
+"""
+import logging
+import threading
+
+
+class Topic:
+
+    def __init__(self, name):
+        self.name = name
+        self._subscribers = ()
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers += (callback,)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s != callback)
+
+    def publish(self, *args):
+        # بدون قفل: فهرست مشترکین هر بار کامل جایگزین می‌شود
+        for callback in self._subscribers:
+            try:
+                callback(*args)
+            except Exception:
+                logging.exception("%s subscriber failed", self.name)
+
+
+cart_changes = Topic("cart_changes")
+
+
+def publish_cart_rows(rows):
+    """
+    Publish (user_id, order_id, menu_id, quantity) rows, one message per order.
+    """
+    if not cart_changes._subscribers:
+        return
+    by_order = {}
+    for user_id, order_id, menu_id, quantity in rows:
+        by_order.setdefault(order_id, []).append((user_id, menu_id, max(0, quantity)))
+    for order_id, delta in by_order.items():
+        cart_changes.publish(order_id, tuple(delta))
@@ -0,0 +1,189 @@
+"""
+Precompiled message templates for the bots' hot screens.
+"""
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from cache import LRUCache
+from config import RENDER_CACHE_SIZE
+from scheduler import SUPERSEDED
+
+
+# ------------------------------
+# Edits that change nothing are skipped
+# ------------------------------
+# (chat_id, message_id) -> fingerprint of the text and keyboard last sent
+_rendered = LRUCache(RENDER_CACHE_SIZE)
+
+
+def _fingerprint(text, reply_markup):
+    return hash((text, reply_markup.model_dump_json(exclude_none=True) if reply_markup else None))
+
+
+def remember(message, text, reply_markup=None):
+    """
+    Record what a freshly sent message shows.
+    """
+    _rendered.set((message.chat.id, message.message_id), _fingerprint(text, reply_markup))
+
+
+async def edit_message(message, text, reply_markup=None):
+    """
+    message.edit_text, skipped when the message already shows exactly this
+    text and keyboard. Returns False when no request was sent, including
+    when the scheduler replaced this edit with a newer one.
+    """
+    key = (message.chat.id, message.message_id)
+    fingerprint = _fingerprint(text, reply_markup)
+    if _rendered.get(key) == fingerprint:
+        return False
+    try:
+        if await message.edit_text(text, reply_markup=reply_markup) is SUPERSEDED:
+            # the newer edit records its own fingerprint
+            return False
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+    _rendered.set(key, fingerprint)
+    return True
+
+
+# ------------------------------
+# User bot main menu
+# ------------------------------
+class MenuTemplate:
+    """
+    Static part of an order's main menu: the full text block and the
+    keyboard layout, with one quantity slot per item button.
+    Rendering for a user only fills in that user's cart counts.
+    """
+
+    def __init__(self, order_id, title, menus):
+        self.text = f"📋 *{title or 'Menu'}*\n\n" + "".join(f'"{name}" - {price}\n' for _, name, price in menus)
+
+        # هر دکمه یا یک آیتم منو است (slot) یا یک دکمه ثابت
+        buttons = [(mid, name, f"item_{order_id}_{mid}") for mid, name, _ in menus]
+        buttons.append(InlineKeyboardButton(text="🛒 View Cart", callback_data=f"viewcart_{order_id}"))
+        buttons.append(InlineKeyboardButton(text="📤 Send Order to Admin", callback_data=f"send_{order_id}"))
+        # same layout InlineKeyboardBuilder.adjust(2) produced: rows of two
+        self.rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+    def render(self, cart_items):
+        """
+        (text, keyboard) for a user's {menu_id: quantity} cart.
+        """
+        keyboard = [
+            [
+                InlineKeyboardButton(text=f"{b[1]}({cart_items.get(b[0], 0)})", callback_data=b[2])
+                if isinstance(b, tuple) else b
+                for b in row
+            ]
+            for row in self.rows
+        ]
+        return self.text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def menu_template(entry):
+    """
+    Template for a cached db.get_order_menu entry, built once per entry;
+    a new entry (after the menu changes) gets a new template.
+    """
+    if entry.template is None:
+        entry.template = MenuTemplate(entry.order_id, entry.title, entry.menus)
+    return entry.template
+
+
+# ------------------------------
+# Admin reports, split into pages
+# ------------------------------
+MESSAGE_LIMIT = 4096
+
+
+def _length(text):
+    # Telegram counts message length in UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+def display_name(report, user_id):
+    # کاربری که /start نزده نام ندارد
+    return report["names"].get(user_id) or f"#{user_id}"
+
+
+def overview_blocks(report):
+    """
+    Order overview from db.get_cart_report_with_prices data:
+    one text block per user, then the per-item totals.
+    """
+    blocks = []
+    for user_id, items in report["users"].items():
+        parts = [f"👤 {display_name(report, user_id)}:\n"]
+        for item_name, data in items.items():
+            parts.append(f"   - {item_name}: {data['quantity']} \n")
+        parts.append("\n")
+        blocks.append("".join(parts))
+
+    parts = ["📊 *Total per item:*\n"]
+    for item_name, data in report["totals"].items():
+        parts.append(f"   - {item_name}: {data['quantity']} \n")
+    blocks.append("".join(parts))
+    return blocks
+
+
+def bill_blocks(report):
+    """
+    Invoice from db.get_cart_report_with_prices data:
+    one text block per user, then the grand total.
+    """
+    blocks = []
+    for user_id, items in report["users"].items():
+        user = display_name(report, user_id)
+        parts = [f"👤 *{user}*\n"]
+        for item_name, data in items.items():
+            parts.append(f"  - {item_name}: {data['quantity']}  --> {data['total_price']} Toman\n")
+        parts.append(f" \n ➤ Total for {user}: {report['user_totals'].get(user_id, 0)} Toman\n\n")
+        blocks.append("".join(parts))
+
+    blocks.append(f"\n💵 *Grand Total: {report['grand_total']} Toman*")
+    return blocks
+
+
+def paginate(title, blocks, limit=MESSAGE_LIMIT):
+    """
+    Join report blocks into pages that fit one message each. Pages break
+    between blocks (users); only a block too long on its own is split by lines.
+    Each page starts with the title, plus "(i/n)" when there is more than one.
+    """
+    room = limit - _length(title) - 16   # title, page counter and blank line
+
+    pieces = []
+    for block in blocks:
+        if _length(block) <= room:
+            pieces.append(block)
+            continue
+        chunk, size = [], 0
+        for line in block.splitlines(keepends=True):
+            while _length(line) > room:
+                # a single line longer than a page is cut
+                pieces.append(line[:room // 2])
+                line = line[room // 2:]
+            if chunk and size + _length(line) > room:
+                pieces.append("".join(chunk))
+                chunk, size = [], 0
+            chunk.append(line)
+            size += _length(line)
+        if chunk:
+            pieces.append("".join(chunk))
+
+    pages, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + _length(piece) > room:
+            pages.append("".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += _length(piece)
+    if current or not pages:
+        pages.append("".join(current))
+
+    if len(pages) == 1:
+        return [f"{title}\n\n{pages[0]}"]
+    return [f"{title} ({i}/{len(pages)})\n\n{page}" for i, page in enumerate(pages, 1)]
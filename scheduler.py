@@ -0,0 +1,230 @@
+"""
+Outbound Telegram request scheduler shared by both bots.
+
+Every Bot API call goes through one priority queue:
+- token buckets enforce a global and a per-chat rate per bot
+- callback answers go first, then edits, then everything else
+- a queued edit of a message is replaced by a newer edit of the same message;
+  the callers of the replaced edits get SUPERSEDED instead of a result
+- 429 responses are retried after the server-given retry_after
+Methods without a chat (getUpdates, getMe, setWebhook, ...) are sent
+directly, except callback answers.
+"""
+import asyncio
+import itertools
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, EditMessageText
+
+from config import TG_CHAT_RATE, TG_GLOBAL_RATE
+
+INTERACTIVE, EDIT, BULK = 0, 1, 2
+MAX_RETRIES = 5
+
+# returned to the callers of an edit that a newer edit of the same message replaced
+SUPERSEDED = object()
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # set after a 429 for this bucket
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        """
+        Seconds until a token is available (0 when one is available now).
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "bot", "method", "make_request", "chat_key", "edit_key",
+                 "futures", "retries")
+
+    def __init__(self, priority, seq, bot, method, make_request, chat_key, edit_key, future):
+        self.priority = priority
+        self.seq = seq
+        self.bot = bot
+        self.method = method
+        self.make_request = make_request
+        self.chat_key = chat_key
+        self.edit_key = edit_key
+        # futures[0] is this job's caller; the rest belong to the edits it
+        # replaced and get SUPERSEDED
+        self.futures = [future]
+        self.retries = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+
+    def __init__(self, global_rate=TG_GLOBAL_RATE, chat_rate=TG_CHAT_RATE):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self._queue = []
+        self._edits = {}      # edit_key -> queued job
+        self._global = {}     # bot id -> TokenBucket
+        self._chats = {}      # (bot id, chat id) -> TokenBucket
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._worker = None
+        self._sending = set()
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None and not isinstance(method, AnswerCallbackQuery):
+            # polling and bot setup must never wait behind queued messages
+            return await make_request(bot, method)
+
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        chat_key = (bot.id, chat_id) if chat_id is not None else None
+        edit_key = None
+        if isinstance(method, (EditMessageText, EditMessageReplyMarkup)) and method.message_id:
+            edit_key = (bot.id, chat_id, method.message_id, type(method))
+
+        job = _Job(self._priority(method), next(self._seq), bot, method, make_request, chat_key, edit_key, future)
+        old = self._edits.pop(edit_key, None) if edit_key else None
+        if old is not None:
+            # فقط آخرین ویرایش همان پیام ارسال می‌شود
+            self._queue.remove(old)
+            job.futures.extend(old.futures)
+            job.seq = old.seq
+        if edit_key:
+            self._edits[edit_key] = job
+        self._queue.append(job)
+        self._wakeup.set()
+        return await future
+
+    @staticmethod
+    def _priority(method):
+        if isinstance(method, AnswerCallbackQuery):
+            return INTERACTIVE
+        if isinstance(method, (EditMessageText, EditMessageReplyMarkup)):
+            return EDIT
+        return BULK
+
+    def _buckets(self, job):
+        bot_bucket = self._global.get(job.bot.id)
+        if bot_bucket is None:
+            bot_bucket = self._global[job.bot.id] = TokenBucket(self.global_rate)
+        if job.chat_key is None:
+            return bot_bucket, None
+        chat_bucket = self._chats.get(job.chat_key)
+        if chat_bucket is None:
+            chat_bucket = self._chats[job.chat_key] = TokenBucket(self.chat_rate, capacity=3)
+        return bot_bucket, chat_bucket
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            next_wait = None
+            self._queue.sort(key=lambda j: (j.priority, j.seq))
+            for job in self._queue:
+                bot_bucket, chat_bucket = self._buckets(job)
+                wait = max(bot_bucket.wait_time(now), chat_bucket.wait_time(now) if chat_bucket else 0)
+                if wait <= 0:
+                    break
+                # a busy chat must not hold up the others
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+            else:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), next_wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._queue.remove(job)
+            if job.edit_key and self._edits.get(job.edit_key) is job:
+                del self._edits[job.edit_key]
+            bot_bucket.take()
+            if chat_bucket:
+                chat_bucket.take()
+            task = asyncio.create_task(self._send(job, bot_bucket, chat_bucket))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, job, bot_bucket, chat_bucket):
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            if job.retries >= MAX_RETRIES:
+                return self._finish(job, error=e)
+            logging.warning("Telegram flood limit, retrying %s in %ss", type(job.method).__name__, e.retry_after)
+            paused_until = time.monotonic() + e.retry_after
+            if chat_bucket is None:
+                bot_bucket.paused_until = paused_until
+            else:
+                chat_bucket.paused_until = paused_until
+            job.retries += 1
+            if job.edit_key:
+                newer = self._edits.get(job.edit_key)
+                if newer is not None:
+                    # یک ویرایش جدیدتر در صف است؛ همان جای این یکی ارسال می‌شود
+                    newer.futures.extend(job.futures)
+                    return
+                self._edits[job.edit_key] = job
+            self._queue.append(job)
+            self._wakeup.set()
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+
+    @staticmethod
+    def _finish(job, result=None, error=None):
+        future = job.futures[0]
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        for future in job.futures[1:]:
+            if not future.done():
+                future.set_result(SUPERSEDED)
+
+    async def close(self):
+        """
+        Stop sending; callers still waiting on a queued request get an error
+        instead of hanging.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._sending:
+            # a 429 retry may put its job back in the queue
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        error = RuntimeError("outbound scheduler closed")
+        for job in self._queue:
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(error)
+        self._queue.clear()
+        self._edits.clear()
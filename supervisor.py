@@ -0,0 +1,381 @@
+"""
+Multi-process entry point: python supervisor.py
+
+The supervisor receives updates for both bots (long polling, or one webhook
+server when BOT_MODE=webhook) and hands them to worker processes:
+- one admin worker, so report rendering and exports never slow down taps
+- USER_WORKERS user-bot workers; updates are sharded by Telegram user id,
+  so a user always lands on the same worker and its in-process caches
+  (FSM state, cart buffer, rendered messages) stay valid
+
+Workers share the SQLite file (WAL, busy timeout, BEGIN IMMEDIATE writes,
+one writer thread per process). Menu, user and report cache invalidations
+are relayed between workers, cart changes to the admin worker. A worker that
+dies is restarted with a backoff; whatever is routed to it meanwhile, or
+beyond WORKER_QUEUE_SIZE queued messages, is dropped and logged. SIGINT /
+SIGTERM stop receiving, let workers drain and shut down cleanly.
+"""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+from config import (ADMIN_BOT_TOKEN, ADMIN_WEBHOOK_PATH, ADMIN_WEBHOOK_SECRET, BOT_MODE, DB_ENGINE,
+                    MAX_CONCURRENT_UPDATES, METRICS_PORT, SHUTDOWN_TIMEOUT, TELEGRAM_API_URL,
+                    TG_GLOBAL_RATE, USER_BOT_TOKEN, USER_WEBHOOK_PATH, USER_WEBHOOK_SECRET,
+                    USER_WORKERS, WEBHOOK_BASE_URL, WEBHOOK_HOST, WEBHOOK_PORT, WORKER_QUEUE_SIZE)
+
+API_BASE = (TELEGRAM_API_URL or "https://api.telegram.org").rstrip("/")
+ALLOWED_UPDATES = ["message", "callback_query"]
+POLL_TIMEOUT = 30
+MAX_BACKOFF = 30
+
+log = logging.getLogger("foodbot.supervisor")
+
+
+def setup_logging():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+
+# ------------------------------
+# Worker process
+# ------------------------------
+def worker_main(role, index, inbox, events):
+    # Ctrl+C و SIGTERM به کل گروه پردازه می‌رسد؛ توقف را supervisor هماهنگ می‌کند
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    setup_logging()
+    asyncio.run(run_worker(role, index, inbox, events))
+
+
+async def run_worker(role, index, inbox, events):
+    import async_db
+    import cache
+    import metrics
+    import pubsub
+    from scheduler import OutboundScheduler
+
+    module = importlib.import_module(f"{role}_bot")
+    dp, bot = module.dp, module.bot
+    name = multiprocessing.current_process().name
+    cache.menus.listeners.append(lambda order_id: events.put(("menus", order_id, name)))
+    cache.users.listeners.append(lambda user_id: events.put(("users", user_id, name)))
+    cache.reports.listeners.append(lambda order_id: events.put(("reports", order_id, name)))
+    if role == "user":
+        # برای گزارش‌های زنده در worker ادمین
+        pubsub.cart_changes.subscribe(lambda order_id, delta: events.put(("cart", (order_id, delta), name)))
+
+    # سقف سراسری تلگرام بین workerهای همان بات تقسیم می‌شود
+    scheduler = OutboundScheduler(global_rate=TG_GLOBAL_RATE / (USER_WORKERS if role == "user" else 1))
+    bot.session.middleware(scheduler)
+    port = METRICS_PORT + (0 if role == "admin" else 1 + index) if METRICS_PORT else 0
+    metrics_runner = await metrics.serve(port=port)
+    await dp.emit_startup(bot=bot)
+
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+    tasks = set()
+
+    async def feed(update):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            logging.exception("Update %s failed", update.get("update_id"))
+        finally:
+            limit.release()
+
+    try:
+        while True:
+            message = await loop.run_in_executor(None, inbox.get)
+            if message is None:
+                break
+            kind, payload = message
+            if kind == "menus":
+                cache.menus.invalidate(payload, notify=False)
+                continue
+            if kind == "reports":
+                cache.reports.invalidate(payload, notify=False)
+                continue
+            if kind == "users":
+                cache.users.invalidate(payload)
+                # گزارش‌های کش‌شده نام قبلی را دارند
+                cache.reports.clear()
+                continue
+            if kind == "cart":
+                pubsub.cart_changes.publish(*payload)
+                continue
+            await limit.acquire()
+            task = asyncio.create_task(feed(payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot)
+        await scheduler.close()
+        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        async_db.close()
+
+
+class Worker:
+
+    def __init__(self, ctx, role, index, events):
+        self.ctx = ctx
+        self.role = role
+        self.index = index
+        self.name = f"{role}-{index}"
+        self.events = events
+        self.inbox = None
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = None
+        self.dropped = 0
+        # send() runs on the relay thread too; start() swaps the queue under it
+        self._lock = threading.Lock()
+
+    def start(self):
+        inbox = self.ctx.Queue(WORKER_QUEUE_SIZE)
+        process = self.ctx.Process(target=worker_main, name=self.name,
+                                   args=(self.role, self.index, inbox, self.events))
+        process.start()
+        with self._lock:
+            old, self.inbox, self.process = self.inbox, inbox, process
+            if old is not None:
+                # a killed worker may still hold the old queue's read lock; whatever
+                # was queued for it is dropped
+                old.cancel_join_thread()
+                old.close()
+            if self.dropped:
+                log.warning("%s: dropped %d messages while it was down or busy", self.name, self.dropped)
+                self.dropped = 0
+        self.started_at = time.monotonic()
+        self.restart_at = None
+
+    def send(self, message):
+        """
+        Queue a message without blocking; it is dropped (and counted) when the
+        worker is down or already has WORKER_QUEUE_SIZE messages waiting.
+        """
+        with self._lock:
+            try:
+                if not self.process.is_alive():
+                    raise queue.Full
+                self.inbox.put_nowait(message)
+                return True
+            except (queue.Full, ValueError, OSError):
+                # ValueError / OSError: the queue was closed
+                if not self.dropped:
+                    log.warning("%s is down or busy, dropping messages for it", self.name)
+                self.dropped += 1
+                return False
+
+    def stop(self):
+        with self._lock:
+            try:
+                self.inbox.put(None, timeout=1)
+            except (queue.Full, ValueError, OSError):
+                pass
+
+
+# ------------------------------
+# Supervisor
+# ------------------------------
+def shard_key(update):
+    """
+    Telegram user id of an update (0 when there is none).
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            return (value.get("from") or value.get("chat") or {}).get("id", 0)
+    return 0
+
+
+class Supervisor:
+
+    def __init__(self, user_workers=USER_WORKERS):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.events = self.ctx.Queue()
+        self.admin = Worker(self.ctx, "admin", 0, self.events)
+        self.users = [Worker(self.ctx, "user", i, self.events) for i in range(max(1, user_workers))]
+        self.workers = [self.admin] + self.users
+
+    def route_admin(self, update):
+        self.admin.send(("update", update))
+
+    def route_user(self, update):
+        self.users[shard_key(update) % len(self.users)].send(("update", update))
+
+    async def run(self):
+        if DB_ENGINE != "sqlite":
+            raise SystemExit("supervisor.py needs DB_ENGINE=sqlite: workers share the database file")
+        import db
+        # مهاجرت‌ها یک بار و پیش از شروع workerها
+        db.init_db()
+        db.pool.close()
+
+        for worker in self.workers:
+            worker.start()
+        log.info("Started %d workers (%s mode)", len(self.workers), BOT_MODE)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        relay = loop.run_in_executor(None, self._relay_events)
+        monitor = asyncio.create_task(self._monitor())
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)) as session:
+            if BOT_MODE == "webhook":
+                receiver = await self._start_webhook(session)
+            else:
+                receiver = [asyncio.create_task(self._poll(session, ADMIN_BOT_TOKEN, self.route_admin)),
+                            asyncio.create_task(self._poll(session, USER_BOT_TOKEN, self.route_user))]
+            await stop.wait()
+
+            log.info("Stopping")
+            if BOT_MODE == "webhook":
+                await receiver.cleanup()
+            else:
+                for task in receiver:
+                    task.cancel()
+                await asyncio.gather(*receiver, return_exceptions=True)
+
+        monitor.cancel()
+        await asyncio.gather(monitor, return_exceptions=True)
+        await self._stop_workers()
+        self.events.put(None)
+        await relay
+
+    # ------------------------------
+    # Receiving updates
+    # ------------------------------
+    async def _poll(self, session, token, route):
+        offset = None
+        backoff = 1
+        try:
+            while True:
+                try:
+                    updates = await call_api(session, token, "getUpdates", offset=offset,
+                                             timeout=POLL_TIMEOUT, allowed_updates=ALLOWED_UPDATES)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.warning("getUpdates failed (%s), retrying in %ss", e, backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                    continue
+                backoff = 1
+                for update in updates:
+                    offset = update["update_id"] + 1
+                    route(update)
+        finally:
+            if offset is not None:
+                # تایید آخرین آپدیت‌ها تا بعد از راه‌اندازی دوباره تکرار نشوند
+                try:
+                    await call_api(session, token, "getUpdates", offset=offset, timeout=0, limit=1)
+                except Exception:
+                    pass
+
+    async def _start_webhook(self, session):
+        app = web.Application()
+        app.router.add_post(ADMIN_WEBHOOK_PATH, webhook_handler(self.route_admin, ADMIN_WEBHOOK_SECRET))
+        app.router.add_post(USER_WEBHOOK_PATH, webhook_handler(self.route_user, USER_WEBHOOK_SECRET))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+        if WEBHOOK_BASE_URL:
+            for token, path, secret in ((ADMIN_BOT_TOKEN, ADMIN_WEBHOOK_PATH, ADMIN_WEBHOOK_SECRET),
+                                        (USER_BOT_TOKEN, USER_WEBHOOK_PATH, USER_WEBHOOK_SECRET)):
+                params = {"url": WEBHOOK_BASE_URL.rstrip("/") + path, "allowed_updates": ALLOWED_UPDATES}
+                if secret:
+                    params["secret_token"] = secret
+                await call_api(session, token, "setWebhook", **params)
+        return runner
+
+    # ------------------------------
+    # Workers
+    # ------------------------------
+    def _relay_events(self):
+        """
+        Runs in a thread: forward menu, user and report invalidations to every
+        other worker and cart changes to the admin worker (live reports).
+        """
+        while True:
+            try:
+                event = self.events.get()
+                if event is None:
+                    return
+                kind, payload, sender = event
+                if kind == "cart":
+                    self.admin.send((kind, payload))
+                    continue
+                for worker in self.workers:
+                    if worker.name != sender:
+                        worker.send((kind, payload))
+            except Exception:
+                # the relay must outlive any single bad event
+                log.exception("Relaying a worker event failed")
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    continue
+                if worker.restart_at is None:
+                    # اجرای طولانی یعنی خرابی تکراری نیست
+                    worker.failures = 1 if now - worker.started_at > 60 else worker.failures + 1
+                    delay = min(2 ** (worker.failures - 1), MAX_BACKOFF)
+                    log.error("%s exited with code %s, restarting in %ss",
+                              worker.name, worker.process.exitcode, delay)
+                    worker.restart_at = now + delay
+                elif now >= worker.restart_at:
+                    log.info("Restarting %s", worker.name)
+                    worker.start()
+
+    async def _stop_workers(self):
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            worker.stop()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker in self.workers:
+            await loop.run_in_executor(None, worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                # workers ignore SIGTERM, so it has to be SIGKILL
+                log.warning("%s did not stop in time, killing it", worker.name)
+                worker.process.kill()
+                worker.process.join()
+
+
+def webhook_handler(route, secret):
+    async def handle(request):
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401)
+        route(await request.json())
+        return web.Response()
+    return handle
+
+
+async def call_api(session, token, method, **params):
+    async with session.post(f"{API_BASE}/bot{token}/{method}", json=params) as response:
+        payload = await response.json(content_type=None)
+    if not payload.get("ok"):
+        raise RuntimeError(f"{method}: {payload.get('description')}")
+    return payload["result"]
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(Supervisor().run())
@@ -0,0 +1,52 @@
+"""
+Shared setup: every test gets fresh SQLite files and empty caches.
+
+Settings are read from the environment when config is first imported, so
+they are fixed here before any module of the bot is loaded.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="foodbot-tests-")
+os.environ.update(
+    DB_NAME=os.path.join(_tmp, "foodbot.db"),
+    ARCHIVE_DB_NAME=os.path.join(_tmp, "foodbot_archive.db"),
+    DB_ENGINE="sqlite",
+    ADMIN_BOT_TOKEN="1000001:test-admin",
+    USER_BOT_TOKEN="1000002:test-user",
+    ADMIN_IDS="1000",
+    METRICS_PORT="0",
+    REPORT_MAX_AGE="0",
+)
+
+import pytest  # noqa: E402
+
+import cache  # noqa: E402
+import db  # noqa: E402
+import memory_db  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    """
+    Point db at new files under tmp_path and run the migrations.
+    """
+    for pool in (db.pool, db.report_pool, db.archive_pool):
+        pool.close()
+    hot, archive = str(tmp_path / "foodbot.db"), str(tmp_path / "foodbot_archive.db")
+    monkeypatch.setattr(db, "DB_PATH", hot)
+    monkeypatch.setattr(db, "ARCHIVE_PATH", archive)
+    monkeypatch.setattr(db.pool, "path", hot)
+    monkeypatch.setattr(db.report_pool, "path", hot)
+    monkeypatch.setattr(db.archive_pool, "path", archive)
+    for c in (cache.menus, cache.reports, cache.users):
+        c.clear()
+    memory_db.reset()
+    db.init_db()
+    yield tmp_path
+    for pool in (db.pool, db.report_pool, db.archive_pool):
+        pool.close()
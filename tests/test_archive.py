@@ -0,0 +1,67 @@
+import sqlite3
+
+import db
+
+
+def _order(title="Trip", users=(7, 8)):
+    order_id = db.create_order(title, 1000)
+    db.add_menus(order_id, [("Tea", 100), ("Cake", 250)])
+    tea, cake = [mid for mid, _, _ in db.get_menus(order_id)]
+    for user_id in users:
+        db.add_user(user_id, f"User {user_id}", None)
+        db.update_cart(user_id, order_id, tea, 2)
+        db.update_cart(user_id, order_id, cake, 1)
+    return order_id
+
+
+def _count(path, table, order_id):
+    conn = sqlite3.connect(path)
+    try:
+        key = "id" if table == "orders_table" else "order_id"
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {key} = ?", (order_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_archived_order_moves_out_of_the_hot_file():
+    order_id, kept = _order(), _order("Lunch")
+    db.finalize_order(order_id)
+    report, priced = db.get_report(order_id), db.get_order_items_report(order_id)
+
+    assert db.archive_orders([order_id]) == [order_id]
+
+    for table in ("orders_table", "menus", "cart", "order_items", "order_totals"):
+        assert _count(db.DB_PATH, table, order_id) == 0
+    for table in ("orders_table", "menus", "order_items"):
+        assert _count(db.ARCHIVE_PATH, table, order_id) > 0
+    assert db.get_order(order_id) is None
+    archived_report, archived_priced = db.get_archived_report(order_id)
+    assert sorted(archived_report) == sorted(report)
+    assert archived_priced["users"] == priced["users"]
+    assert archived_priced["names"] == {7: "User 7", 8: "User 8"}
+    # other orders are untouched
+    assert db.get_order(kept) is not None
+    assert _count(db.DB_PATH, "cart", kept) == 4
+
+
+def test_closed_order_keeps_its_snapshots():
+    order_id = _order()
+    db.close_order(order_id)
+    db.save_order_snapshots(order_id, {"xlsx": b"sheet"})
+    db.archive_orders([order_id])
+    assert _count(db.DB_PATH, "cart", order_id) == 0
+    assert db.get_order_snapshot(order_id, "xlsx") == b"sheet"
+
+
+def test_archive_by_age_and_rerun():
+    old, new = _order(), _order("Lunch")
+    with db.connection() as conn:
+        conn.execute("UPDATE orders_table SET created_at = datetime('now', '-40 days') WHERE id = ?", (old,))
+
+    assert db.archive_orders(older_than_days=30) == [old]
+    assert db.archive_orders(older_than_days=30) == []
+    assert db.archive_orders([old, 999]) == []
+    assert db.get_order(new) is not None
+    # the hot file was switched to incremental auto_vacuum on the first run
+    conn = sqlite3.connect(db.DB_PATH)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
@@ -0,0 +1,61 @@
+import asyncio
+
+import async_db
+import db
+from cart_buffer import CartBuffer
+
+
+def _order():
+    order_id = db.create_order("Trip", 1000)
+    db.add_menus(order_id, [("Tea", 100), ("Cake", 250)])
+    return order_id, [mid for mid, _, _ in db.get_menus(order_id)]
+
+
+def test_taps_are_folded_into_one_write():
+    order_id, (tea, cake) = _order()
+    db.update_cart(7, order_id, tea, 2)
+
+    async def main():
+        buffer = CartBuffer(enabled=True, delay=60)
+        writes = async_db.writer_stats["writes"]
+        shown = [await buffer.change(7, order_id, tea, change) for change in (1, 1, -1, 1)]
+        shown.append(await buffer.change(7, order_id, cake, -1))
+        pending = dict(buffer.overlay(7, order_id, {}))
+        # nothing written before the flush
+        assert db.get_cart_quantity(7, order_id, tea) == 2
+        await buffer.flush()
+        return shown, pending, async_db.writer_stats["writes"] - writes
+
+    shown, pending, writes = asyncio.run(main())
+    assert shown == [3, 4, 3, 4, 0]
+    assert pending == {tea: 4, cake: 0}
+    assert writes == 1
+    assert db.get_cart_quantity(7, order_id, tea) == 4
+    assert db.get_cart_quantity(7, order_id, cake) == 0
+
+
+def test_flushes_after_the_delay():
+    order_id, (tea, _) = _order()
+
+    async def main():
+        buffer = CartBuffer(enabled=True, delay=0.01)
+        await buffer.change(7, order_id, tea, 1)
+        await buffer.change(7, order_id, tea, 1)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not buffer._pending and not buffer._flushing:
+                break
+
+    asyncio.run(main())
+    assert db.get_cart_quantity(7, order_id, tea) == 2
+
+
+def test_disabled_buffer_writes_through():
+    order_id, (tea, _) = _order()
+
+    async def main():
+        buffer = CartBuffer(enabled=False)
+        return await buffer.change(7, order_id, tea, 3)
+
+    assert asyncio.run(main()) == 3
+    assert db.get_cart_quantity(7, order_id, tea) == 3
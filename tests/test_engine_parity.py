@@ -0,0 +1,77 @@
+"""
+memory_db must answer like db.py: one scripted session is run on both
+engines and every result is compared.
+"""
+import random
+
+import cache
+import db
+import memory_db
+
+
+def _session(engine):
+    cache.menus.clear()
+    rng = random.Random(3)
+    log = []
+    for u in range(1, 8):
+        engine.add_user(u, f"U{u}", None)
+    engine.update_user_name(3, "Renamed")
+    orders = [engine.create_order(t, 1) for t in ("Trip", "trip b", "Lunch", "Tour", "Dinner", "TRIPX")]
+    for o in orders:
+        for i in range(4):
+            engine.add_menu(o, f"item{i % 3}", 100 + i * 10)
+    mids = {o: [m[0] for m in engine.get_menus(o)] for o in orders}
+
+    for _ in range(400):
+        u, o = rng.randint(1, 9), rng.choice(orders[:3])
+        log.append(engine.update_cart(u, o, rng.choice(mids[o]), rng.choice([1, 1, 2, -1, -3])))
+    engine.set_cart_quantities([(1, orders[0], mids[orders[0]][0], 7), (2, orders[0], mids[orders[0]][1], 0)])
+    log.append(engine.finalize_cart(1, orders[0]))
+    log.append(engine.finalize_cart(1, orders[0]))
+    log.append(engine.finalize_order(orders[1]))
+    engine.add_order(2, orders[1], mids[orders[1]][0], 2)
+    engine.clear_cart(4, orders[2])
+
+    for o in orders[:3]:
+        log += [engine.get_report(o), engine.get_cart_report_summary(o), engine.get_cart_report_with_prices(o),
+                engine.get_order_items_report(o), [engine.get_cart(u, o) for u in range(1, 10)],
+                engine.get_menu_screen(2, o)[1], engine.get_item_screen(2, o, mids[o][1])]
+    for args in ({}, {"limit": 2}, {"before_id": 5, "limit": 2}, {"after_id": 2, "limit": 2},
+                 {"prefix": "tr"}, {"prefix": "TRIPX"}):
+        log.append(engine.get_orders_page(**args))
+
+    engine.save_fsm_states([("a", "s", "{}", 1.0), ("b", None, "{}", 5.0), ("c", None, '{"x":1}', 9.0)])
+    log += [engine.load_fsm_state(k) for k in "abc"] + [engine.purge_fsm_states(5.0)]
+    log += [engine.get_user(3), engine.get_order(orders[2]), engine.get_order(999)]
+
+    # lifecycle
+    log.append(engine.close_order(orders[2]))
+    log.append(engine.close_order(orders[2]))
+    try:
+        engine.update_cart(5, orders[2], mids[orders[2]][0], 1)
+        log.append("written")
+    except db.OrderClosed:
+        log.append("closed")
+    log.append(engine.get_order_menu(orders[2]).status)
+    log.append(engine.reopen_order(orders[2]))
+    log.append(engine.update_cart(5, orders[2], mids[orders[2]][0], 1))
+    return [list(x) if isinstance(x, tuple) else x for x in log]
+
+
+def _normalize(value):
+    # row order is not part of the contract, only the rows
+    if isinstance(value, dict):
+        return sorted((k, _normalize(v)) for k, v in value.items())
+    if isinstance(value, list) and value and isinstance(value[0], (list, tuple)) \
+            and not isinstance(value[0][0] if value[0] else 0, (list, tuple)):
+        return sorted(map(repr, value))
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def test_engines_agree():
+    sqlite_log, memory_log = _session(db), _session(memory_db)
+    assert len(sqlite_log) == len(memory_log)
+    mismatches = [(i, a, b) for i, (a, b) in enumerate(zip(sqlite_log, memory_log)) if _normalize(a) != _normalize(b)]
+    assert mismatches == []
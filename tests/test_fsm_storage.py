@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+import db
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+
+def test_state_survives_a_restart():
+    async def main():
+        storage = SQLiteStorage(flush_delay=60)
+        await storage.set_state(KEY, "MenuStates:waiting_for_item_name")
+        await storage.update_data(KEY, {"order_id": 3})
+        await storage.close()
+
+        # a new process starts with an empty cache
+        restarted = SQLiteStorage(flush_delay=60)
+        return await restarted.get_state(KEY), await restarted.get_data(KEY)
+
+    assert asyncio.run(main()) == ("MenuStates:waiting_for_item_name", {"order_id": 3})
+
+
+def test_changes_are_batched_until_flush():
+    async def main():
+        storage = SQLiteStorage(flush_delay=60)
+        for i in range(5):
+            await storage.set_data(StorageKey(bot_id=1, chat_id=i, user_id=i), {"i": i})
+        k = storage.key_builder.build(StorageKey(bot_id=1, chat_id=4, user_id=4))
+        before = db.load_fsm_state(k)
+        await storage.flush()
+        return before, db.load_fsm_state(k)
+
+    before, after = asyncio.run(main())
+    assert before is None
+    assert after[1] == '{"i": 4}'
+
+
+def test_abandoned_state_expires():
+    async def main():
+        storage = SQLiteStorage(ttl=60, flush_delay=60)
+        await storage.set_state(KEY, "NameForm:waiting_for_name")
+        k = storage.key_builder.build(KEY)
+        storage._dirty[k].updated_at = time.time() - 120
+        return await storage.get_state(KEY)
+
+    assert asyncio.run(main()) is None
+
+
+def test_purge_drops_expired_rows():
+    db.save_fsm_states([("old", "s", "{}", time.time() - 120), ("new", "s", "{}", time.time())])
+
+    async def main():
+        return await SQLiteStorage(ttl=60, flush_delay=60).purge()
+
+    assert asyncio.run(main()) == 1
+    assert db.load_fsm_state("old") is None
+    assert db.load_fsm_state("new") is not None
@@ -0,0 +1,37 @@
+from io import BytesIO
+
+import openpyxl
+
+from utils import parse_menu_csv, parse_menu_text, parse_menu_xlsx
+
+
+def _xlsx(rows):
+    wb = openpyxl.Workbook()
+    for row in rows:
+        wb.active.append(row)
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def test_pasted_lines():
+    items, errors = parse_menu_text("Tea - 100\nCake\t۲۵۰\n\nSoup - free")
+    assert items == [("Tea", 100), ("Cake", 250)]
+    assert errors == [(4, "Soup - free", "price must be a number")]
+
+
+def test_csv_header_is_skipped():
+    assert parse_menu_csv(b"Name,Price\nTea,100\n") == ([("Tea", 100)], [])
+    assert parse_menu_csv("نام,قیمت\nTea,۱۰۰\n".encode()) == ([("Tea", 100)], [])
+
+
+def test_first_row_with_bad_price_is_reported():
+    items, errors = parse_menu_csv(b"Pizza,abc\nTea,100\n")
+    assert items == [("Tea", 100)]
+    assert errors == [(1, "Pizza,abc", "price must be a number")]
+
+
+def test_xlsx():
+    items, errors = parse_menu_xlsx(_xlsx([("item", "price"), ("Tea", 100), ("Cake", 2.5), ("", None)]))
+    assert items == [("Tea", 100)]
+    assert errors == [(3, "Cake | 2.5", "price must be a whole number")]
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.filters import Command
+from aiogram.types import Chat, Message, Update, User
+
+import metrics
+
+
+def _update(update_id, text):
+    message = Message(message_id=update_id, date=datetime.now(), text=text,
+                      chat=Chat(id=7, type="private"), from_user=User(id=7, is_bot=False, first_name="t"))
+    return Update(update_id=update_id, message=message)
+
+
+def test_handler_label_is_the_matched_handler(monkeypatch):
+    monkeypatch.setattr(metrics, "registry", metrics.Registry())
+    dp = Dispatcher()
+
+    @dp.message(F.text.startswith("/start"))
+    async def start(message):
+        pass
+
+    @dp.message(Command("boom"))
+    async def boom(message):
+        raise ValueError
+
+    metrics.install(dp, "user")
+    bot = Bot("1000002:test-user")
+
+    async def feed():
+        for i, text in enumerate(["/start", "/startGARBAGE", "/startX_1", "/nope", "hello", "/boom"]):
+            try:
+                await dp.feed_update(bot, _update(i, text))
+            except ValueError:
+                pass
+        await bot.session.close()
+    asyncio.run(feed())
+
+    counts = {name: h.count for (_, name), h in metrics.registry.handlers.items()}
+    assert counts == {"start": 3, "other": 2, "boom": 1}
+    assert metrics.registry.errors == {("user", "boom"): 1}
+
+
+def test_in_lists_share_one_query_series():
+    registry = metrics.Registry()
+    for n in (1, 3, 900):
+        sql = "SELECT user_id, name FROM users\n WHERE user_id IN (%s)" % ",".join("?" * n)
+        registry.observe_query(sql, 0.001, n, 1)
+
+    assert list(registry.queries) == ["SELECT user_id, name FROM users WHERE user_id IN (...)"]
+    assert registry.queries["SELECT user_id, name FROM users WHERE user_id IN (...)"][0] == 3
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+
+import db
+
+
+def _latest(directory):
+    return max(int(f.split("_", 1)[0]) for f in os.listdir(directory) if f.endswith(".sql"))
+
+
+def _names(conn, kind):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+def test_fresh_database_is_at_latest_version(fresh_db):
+    conn = sqlite3.connect(db.DB_PATH)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == _latest(db.MIGRATIONS_DIR)
+    assert {"orders_table", "menus", "users", "cart", "order_items", "order_totals",
+            "order_item_totals", "order_user_totals", "fsm_state", "order_snapshots"} <= _names(conn, "table")
+    assert {"cart_totals_insert", "cart_totals_update", "cart_totals_delete",
+            "cart_closed_insert", "cart_closed_update", "cart_closed_delete"} <= _names(conn, "trigger")
+
+
+def test_migrate_is_idempotent(fresh_db):
+    conn = sqlite3.connect(db.DB_PATH)
+    before = _names(conn, "table") | _names(conn, "index") | _names(conn, "trigger")
+    db.migrate(conn)
+    assert _names(conn, "table") | _names(conn, "index") | _names(conn, "trigger") == before
+
+
+def test_upgrade_backfills_existing_carts(tmp_path):
+    # a database from before the aggregates: only the initial schema, with carts in it
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    with open(os.path.join(db.MIGRATIONS_DIR, "0001_initial.sql"), encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.execute("PRAGMA user_version = 1")
+    conn.execute("INSERT INTO orders_table (id, title, created_by) VALUES (1, 'Trip', 1000)")
+    conn.executemany("INSERT INTO menus (id, order_id, name, price) VALUES (?, 1, ?, ?)",
+                     [(1, "Tea", 100), (2, "Cake", 250)])
+    conn.executemany("INSERT INTO cart (user_id, order_id, menu_id, quantity) VALUES (?, 1, ?, ?)",
+                     [(7, 1, 2), (7, 2, 1), (8, 1, 3)])
+    conn.commit()
+
+    db.migrate(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == _latest(db.MIGRATIONS_DIR)
+    assert conn.execute("SELECT quantity, total_price FROM order_totals WHERE order_id = 1").fetchone() == (6, 750)
+    assert conn.execute("SELECT status FROM orders_table WHERE id = 1").fetchone() == ("open",)
+
+
+def test_archive_migrations(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "archive.db"))
+    db.migrate(conn, db.ARCHIVE_MIGRATIONS_DIR)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == _latest(db.ARCHIVE_MIGRATIONS_DIR)
+    assert {"orders_table", "menus", "cart", "order_items", "order_snapshots"} <= _names(conn, "table")
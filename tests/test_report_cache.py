@@ -0,0 +1,29 @@
+import cache
+import db
+
+
+def test_forget_reports_is_relayed_and_drops_every_report_of_the_order(monkeypatch):
+    relayed = []
+    monkeypatch.setattr(cache.reports, "listeners", [relayed.append])
+    cache.reports.set(("get_report", 1), (0, "a"))
+    cache.reports.set(("get_cart_report_with_prices", 1), (0, "b"))
+    cache.reports.set(("get_report", 2), (0, "c"))
+
+    db.forget_reports(1)
+
+    assert relayed == [1]
+    assert cache.reports.get(("get_report", 1)) is None
+    assert cache.reports.get(("get_cart_report_with_prices", 1)) is None
+    assert cache.reports.get(("get_report", 2)) == (0, "c")
+
+    # what another worker relayed is not sent back
+    cache.reports.invalidate(2, notify=False)
+    assert relayed == [1]
+    assert cache.reports.get(("get_report", 2)) is None
+
+
+def test_report_read_before_an_invalidation_is_not_stored():
+    version = cache.reports.version
+    cache.reports.invalidate(1, notify=False)
+    cache.reports.set(("get_report", 1), (0, "stale"), version)
+    assert cache.reports.get(("get_report", 1)) is None
@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, GetUpdates, SendMessage
+
+import render
+from scheduler import SUPERSEDED, OutboundScheduler
+
+BOT = SimpleNamespace(id=1)
+
+
+class FakeApi:
+
+    def __init__(self, fail_first=0):
+        self.sent = []
+        self.fail_first = fail_first
+
+    async def __call__(self, bot, method):
+        await asyncio.sleep(0.001)
+        if self.fail_first:
+            self.fail_first -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        self.sent.append(method)
+        return True
+
+
+def _message(scheduler, api, chat_id=5, message_id=9):
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id)
+
+    async def edit_text(text, reply_markup=None):
+        return await scheduler(api, BOT, EditMessageText(chat_id=chat_id, message_id=message_id, text=text))
+    message.edit_text = edit_text
+    return message
+
+
+async def _drain_chat(scheduler, api, chat_id=5):
+    # the per-chat bucket holds 3 tokens; what comes next has to queue
+    for _ in range(3):
+        await scheduler(api, BOT, SendMessage(chat_id=chat_id, text="x"))
+
+
+def test_queued_edits_are_merged():
+    async def main():
+        api, scheduler = FakeApi(), OutboundScheduler(global_rate=100, chat_rate=20)
+        await _drain_chat(scheduler, api)
+        calls = [scheduler(api, BOT, EditMessageText(chat_id=5, message_id=9, text=t)) for t in ("a", "b", "c")]
+        results = await asyncio.gather(*calls)
+        await scheduler.close()
+        return api, results
+
+    api, results = asyncio.run(main())
+    assert [m.text for m in api.sent if isinstance(m, EditMessageText)] == ["c"]
+    assert results == [SUPERSEDED, SUPERSEDED, True]
+
+
+def test_superseded_edit_is_not_remembered():
+    # ➕➕ merged into one edit, then ➖ back to the first text must still be sent
+    async def main():
+        api, scheduler = FakeApi(), OutboundScheduler(global_rate=100, chat_rate=20)
+        message = _message(scheduler, api)
+        render.remember(message, "qty 1")
+        await _drain_chat(scheduler, api)
+        merged = await asyncio.gather(render.edit_message(message, "qty 2"), render.edit_message(message, "qty 3"))
+        back = await render.edit_message(message, "qty 2")
+        await scheduler.close()
+        return api, merged, back
+
+    api, merged, back = asyncio.run(main())
+    assert merged == [False, True]
+    assert back is True
+    assert [m.text for m in api.sent if isinstance(m, EditMessageText)] == ["qty 3", "qty 2"]
+
+
+def test_callback_answers_go_first():
+    async def main():
+        api, scheduler = FakeApi(), OutboundScheduler(global_rate=5, chat_rate=100)
+        # use up the bot's global bucket across several chats
+        await asyncio.gather(*(scheduler(api, BOT, SendMessage(chat_id=100 + i, text="x")) for i in range(5)))
+        bulk = asyncio.ensure_future(scheduler(api, BOT, SendMessage(chat_id=7, text="bulk")))
+        await asyncio.sleep(0)
+        answer = asyncio.ensure_future(scheduler(api, BOT, AnswerCallbackQuery(callback_query_id="1")))
+        await asyncio.gather(bulk, answer)
+        await scheduler.close()
+        return api
+
+    api = asyncio.run(main())
+    assert [type(m) for m in api.sent[5:]] == [AnswerCallbackQuery, SendMessage]
+
+
+def test_methods_without_chat_skip_the_queue():
+    async def main():
+        api, scheduler = FakeApi(), OutboundScheduler(global_rate=100, chat_rate=1)
+        await _drain_chat(scheduler, api)
+        queued = [asyncio.ensure_future(scheduler(api, BOT, SendMessage(chat_id=5, text="later")))
+                  for _ in range(3)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(scheduler(api, BOT, GetUpdates()), 0.5)
+        sent_before = [type(m) for m in api.sent]
+        await scheduler.close()
+        await asyncio.gather(*queued, return_exceptions=True)
+        return sent_before
+
+    assert asyncio.run(main())[-1] is GetUpdates
+
+
+def test_flood_limit_is_retried():
+    async def main():
+        api, scheduler = FakeApi(fail_first=2), OutboundScheduler(global_rate=100, chat_rate=100)
+        result = await scheduler(api, BOT, SendMessage(chat_id=5, text="x"))
+        await scheduler.close()
+        return api, result
+
+    api, result = asyncio.run(main())
+    assert result is True
+    assert len(api.sent) == 1
+
+
+def test_close_fails_queued_requests():
+    async def main():
+        api, scheduler = FakeApi(), OutboundScheduler(global_rate=100, chat_rate=1)
+        await _drain_chat(scheduler, api)
+        queued = [asyncio.ensure_future(scheduler(api, BOT, SendMessage(chat_id=5, text="later")))
+                  for _ in range(2)]
+        queued.append(asyncio.ensure_future(
+            scheduler(api, BOT, EditMessageText(chat_id=5, message_id=9, text="edit"))))
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+        return await asyncio.wait_for(asyncio.gather(*queued, return_exceptions=True), 1)
+
+    results = asyncio.run(main())
+    assert len(results) == 3
+    for result in results:
+        with pytest.raises(RuntimeError):
+            raise result
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+import db
+
+
+def _order(items=3):
+    order_id = db.create_order("Trip", 1000)
+    db.add_menus(order_id, [(f"Item {i}", 100 + i * 50) for i in range(items)])
+    return order_id, [mid for mid, _, _ in db.get_menus(order_id)]
+
+
+def _totals(order_id):
+    with db.connection() as conn:
+        expected = conn.execute("""
+            SELECT COALESCE(SUM(c.quantity), 0), COALESCE(SUM(c.quantity * m.price), 0)
+            FROM cart c JOIN menus m ON m.id = c.menu_id WHERE c.order_id = ?
+        """, (order_id,)).fetchone()
+        kept = conn.execute("SELECT quantity, total_price FROM order_totals WHERE order_id = ?",
+                            (order_id,)).fetchone() or (0, 0)
+        by_user = conn.execute("""
+            SELECT user_id, SUM(c.quantity), SUM(c.quantity * m.price)
+            FROM cart c JOIN menus m ON m.id = c.menu_id WHERE c.order_id = ? GROUP BY user_id
+        """, (order_id,)).fetchall()
+        kept_by_user = conn.execute("""
+            SELECT user_id, quantity, total_price FROM order_user_totals WHERE order_id = ? AND quantity > 0
+        """, (order_id,)).fetchall()
+    return expected, kept, sorted(by_user), sorted(kept_by_user)
+
+
+def test_aggregates_follow_cart_writes():
+    order_id, menu_ids = _order()
+    rng = random.Random(5)
+    for _ in range(300):
+        db.update_cart(rng.randint(1, 6), order_id, rng.choice(menu_ids), rng.choice((1, 1, 2, -1, -3)))
+    db.set_cart_quantities([(1, order_id, menu_ids[0], 9), (2, order_id, menu_ids[1], 0)])
+    db.clear_cart(3, order_id)
+
+    expected, kept, by_user, kept_by_user = _totals(order_id)
+    assert kept == expected
+    assert kept_by_user == by_user
+
+
+def test_closed_order_freezes_cart():
+    order_id, menu_ids = _order()
+    db.update_cart(7, order_id, menu_ids[0], 2)
+    assert db.close_order(order_id) is not None
+
+    with pytest.raises(db.OrderClosed):
+        db.update_cart(7, order_id, menu_ids[1], 1)
+    with pytest.raises(db.OrderClosed):
+        db.update_cart(8, order_id, menu_ids[0], -1)
+    # the triggers also stop writes that do not go through update_cart
+    with db.connection() as conn:
+        conn.execute("UPDATE cart SET quantity = 5 WHERE order_id = ?", (order_id,))
+        conn.execute("DELETE FROM cart WHERE order_id = ?", (order_id,))
+        conn.execute("INSERT INTO cart (user_id, order_id, menu_id, quantity) VALUES (9, ?, ?, 1)",
+                     (order_id, menu_ids[2]))
+    with db.connection() as conn:
+        assert conn.execute("SELECT user_id, menu_id, quantity FROM cart WHERE order_id = ?",
+                            (order_id,)).fetchall() == [(7, menu_ids[0], 2)]
+    assert _totals(order_id)[1] == (2, 200)
+
+    assert db.reopen_order(order_id)
+    assert db.update_cart(7, order_id, menu_ids[0], 1) == 3
+
+
+def test_other_orders_stay_writable():
+    closed, _ = _order()
+    open_, open_menus = _order()
+    db.close_order(closed)
+    assert db.update_cart(7, open_, open_menus[0], 1) == 1
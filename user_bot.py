@@ -1,17 +1,25 @@
 import asyncio
-import sqlite3
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-import db
-from config import USER_BOT_TOKEN
-
-bot = Bot(token=USER_BOT_TOKEN)
-storage = MemoryStorage()
+import async_db
+import cache
+import metrics
+from fsm_storage import SQLiteStorage
+from cart_buffer import CartBuffer
+from render import edit_message, menu_template, remember
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import MAX_CONCURRENT_UPDATES, TELEGRAM_API_URL, USER_BOT_TOKEN
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=USER_BOT_TOKEN, session=session)
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
+metrics.install(dp, "user")
+cart = CartBuffer()
 
 # ------------------------------ #
 # FSM for registering/changing name
@@ -23,63 +31,36 @@ class NameForm(StatesGroup):
 # Show main menu
 # ------------------------------ #
 async def show_main_menu(message_or_cb, order_id, edit=False):
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, price FROM menus WHERE order_id = ?", (order_id,))
-    menus = cursor.fetchall()
-
-    cursor.execute("SELECT menu_id, quantity FROM cart WHERE user_id = ? AND order_id = ?",
-                   (getattr(message_or_cb.from_user, 'id', message_or_cb.from_user.id), order_id))
-    cart_items = dict(cursor.fetchall())
-    conn.close()
+    user_id = getattr(message_or_cb.from_user, 'id', message_or_cb.from_user.id)
+    entry, cart_items = await async_db.get_menu_screen(user_id, order_id)
+    cart.overlay(user_id, order_id, cart_items)
 
-    if not menus:
+    if not entry.menus:
         text = "🍽 No menu yet."
         if isinstance(message_or_cb, CallbackQuery):
-            await message_or_cb.message.edit_text(text)
+            await edit_message(message_or_cb.message, text)
         else:
             await message_or_cb.answer(text)
         return
 
-    # عنوان منو
-    cursor = sqlite3.connect("foodbot.db").cursor()
-    cursor.execute("SELECT title FROM orders_table WHERE id = ?", (order_id,))
-    title_row = cursor.fetchone()
-    menu_title = title_row[0] if title_row else "Menu"
-    text = f"📋 *{menu_title}*\n\n"
-
-    builder = InlineKeyboardBuilder()
-    for mid, name, price in menus:
-        qty = cart_items.get(mid, 0)
-        text += f'"{name}" - {price}\n'
-        builder.button(text=f"{name}({qty})", callback_data=f"item_{order_id}_{mid}")
-    builder.adjust(1)
-
-    builder.button(text="🛒 View Cart", callback_data=f"viewcart_{order_id}")
-    builder.button(text="📤 Send Order to Admin", callback_data=f"send_{order_id}")
-    builder.adjust(2)
-
-    kb = builder.as_markup()
+    # متن و چیدمان منو از قبل ساخته شده، فقط تعدادها پر می‌شوند
+    text, kb = menu_template(entry).render(cart_items)
     if isinstance(message_or_cb, CallbackQuery):
-        await message_or_cb.message.edit_text(text, reply_markup=kb)
+        await edit_message(message_or_cb.message, text, reply_markup=kb)
     else:
-        await message_or_cb.answer(text, reply_markup=kb)
+        sent = await message_or_cb.answer(text, reply_markup=kb)
+        remember(sent, text, kb)
 
 # ------------------------------ #
 # Show item menu
 # ------------------------------ #
-async def show_item_menu(callback: CallbackQuery, order_id, menu_id):
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, price FROM menus WHERE id = ?", (menu_id,))
-    item = cursor.fetchone()
-    cursor.execute("SELECT quantity FROM cart WHERE user_id = ? AND order_id = ? AND menu_id = ?",
-                   (callback.from_user.id, order_id, menu_id))
-    qty_row = cursor.fetchone()
-    qty = qty_row[0] if qty_row else 0
-    conn.close()
-
-
+async def show_item_menu(callback: CallbackQuery, order_id, menu_id, qty=None):
+    if qty is None:
+        item, qty = await async_db.get_item_screen(callback.from_user.id, order_id, menu_id)
+        qty = cart.quantity(callback.from_user.id, order_id, menu_id, qty)
+    else:
+        # تعداد از بافر سبد آمده، فقط نام و قیمت لازم است
+        item = (await async_db.get_order_menu(order_id)).items.get(menu_id)
 
     text = f'"{item[0]}" - {item[1]} Toman\n\nQuantity Ordered: {qty}\n'
 
@@ -93,23 +74,15 @@ async def show_item_menu(callback: CallbackQuery, order_id, menu_id):
     builder.adjust(1)
 
     kb = builder.as_markup()
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_message(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 # ------------------------------ #
 # Show cart
 # ------------------------------ #
 async def show_cart(callback: CallbackQuery, order_id):
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT m.name, m.price, c.quantity
-        FROM cart c
-        JOIN menus m ON c.menu_id = m.id
-        WHERE c.user_id = ? AND c.order_id = ?
-    """, (callback.from_user.id, order_id))
-    items = cursor.fetchall()
-    conn.close()
+    await cart.flush()
+    items = await async_db.get_cart(callback.from_user.id, order_id)
 
     if not items:
         await callback.answer("❌ Cart is empty.", show_alert=True)
@@ -117,7 +90,7 @@ async def show_cart(callback: CallbackQuery, order_id):
 
     text = "🛒 *Your Cart:*\n\n"
     total = 0
-    for name, price, qty in items:
+    for _, name, price, qty in items:
         subtotal = price * qty
         text += f'"{name}({qty})" --> "{subtotal} Toman"\n'
         total += subtotal
@@ -128,7 +101,7 @@ async def show_cart(callback: CallbackQuery, order_id):
     builder.adjust(1)
 
     kb = builder.as_markup()
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_message(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 # ------------------------------ #
@@ -136,11 +109,7 @@ async def show_cart(callback: CallbackQuery, order_id):
 # ------------------------------ #
 @dp.message(F.text.startswith("/start"))
 async def start_handler(message: Message, state: FSMContext):
-    conn = sqlite3.connect("foodbot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT fullname FROM users WHERE id = ?", (message.from_user.id,))
-    row = cursor.fetchone()
-    conn.close()
+    user = await async_db.get_user(message.from_user.id)
 
     args = message.text.split()
     if len(args) > 1 and args[1].isdigit():
@@ -149,9 +118,9 @@ async def start_handler(message: Message, state: FSMContext):
         await message.answer("👋 Welcome! Click a link from admin to start ordering.")
         return
 
-    if row and row[0]:
+    if user and user[1]:
         # اسم کاربر موجود است
-        user_name = row[0]
+        user_name = user[1]
         await message.answer(f"{user_name}, welcome back!")
     else:
         # FSM برای گرفتن اسم
@@ -173,7 +142,7 @@ async def process_name(message: Message, state: FSMContext):
     order_id = data.get("order_id")
 
     # ذخیره در دیتابیس
-    db.add_user(message.from_user.id, user_name, getattr(message.from_user, "username", None))
+    await async_db.add_user(message.from_user.id, user_name, getattr(message.from_user, "username", None))
 
     await message.answer(f"Thanks {user_name}! You are registered.")
     await state.clear()
@@ -195,17 +164,32 @@ async def item_selected(callback: CallbackQuery):
     _, order_id, menu_id = callback.data.split("_")
     await show_item_menu(callback, int(order_id), int(menu_id))
 
+ORDER_CLOSED = "🔒 This order is closed."
+
+async def order_open(order_id):
+    # از entry کش منو؛ تا وقتی در کش است هیچ کوئری‌ای زده نمی‌شود
+    entry = cache.menus.get(order_id) or await async_db.get_order_menu(order_id)
+    return entry.is_open()
+
+async def change_quantity(callback: CallbackQuery, qty_change):
+    _, order_id, menu_id = callback.data.split("_")
+    order_id, menu_id = int(order_id), int(menu_id)
+    if not await order_open(order_id):
+        return await callback.answer(ORDER_CLOSED, show_alert=True)
+    try:
+        qty = await cart.change(callback.from_user.id, order_id, menu_id, qty_change)
+    except async_db.OrderClosed:
+        # closed by another process a moment ago
+        return await callback.answer(ORDER_CLOSED, show_alert=True)
+    await show_item_menu(callback, order_id, menu_id, qty)
+
 @dp.callback_query(F.data.startswith("inc_"))
 async def inc_item(callback: CallbackQuery):
-    _, order_id, menu_id = callback.data.split("_")
-    db.update_cart(callback.from_user.id, int(order_id), int(menu_id), 1)
-    await show_item_menu(callback, int(order_id), int(menu_id))
+    await change_quantity(callback, 1)
 
 @dp.callback_query(F.data.startswith("dec_"))
 async def dec_item(callback: CallbackQuery):
-    _, order_id, menu_id = callback.data.split("_")
-    db.update_cart(callback.from_user.id, int(order_id), int(menu_id), -1)
-    await show_item_menu(callback, int(order_id), int(menu_id))
+    await change_quantity(callback, -1)
 
 @dp.callback_query(F.data.startswith("back_"))
 async def back_to_menu(callback: CallbackQuery):
@@ -218,22 +202,46 @@ async def view_cart(callback: CallbackQuery):
     _, order_id = callback.data.split("_")
     await show_cart(callback, int(order_id))
 
+# (user_id, order_id) whose send is in progress; a double tap is dropped
+sending = set()
+
 @dp.callback_query(F.data.startswith("send_"))
 async def send_order(callback: CallbackQuery):
     order_id = int(callback.data.split("_")[1])
-    cart = db.get_cart(callback.from_user.id, order_id)
-    if not cart:
+    key = (callback.from_user.id, order_id)
+    if key in sending:
+        return await callback.answer("⏳ Sending...")
+    if not await order_open(order_id):
+        # closing the order already sent every cart
+        return await callback.answer(f"{ORDER_CLOSED} Your cart was sent with it.", show_alert=True)
+
+    sending.add(key)
+    try:
+        await cart.flush()
+        finalized = await async_db.finalize_cart(callback.from_user.id, order_id)
+    finally:
+        sending.discard(key)
+    if not finalized:
         return await callback.answer("❌ Cart is empty.")
 
-    await callback.message.edit_text("Thank you!\nYour Order Sent To Admin\nEnjoy it :)")
+    await edit_message(callback.message, "Thank you!\nYour Order Sent To Admin\nEnjoy it :)")
     await callback.answer("Order finalized!")
 
 # ------------------------------ #
 # Main
 # ------------------------------ #
+@dp.startup()
+async def on_startup():
+    await async_db.init_db()
+    await storage.purge()
+
+@dp.shutdown()
+async def on_shutdown():
+    await cart.flush()
+    await storage.close()
+
 async def main():
-    db.init_db()
-    await dp.start_polling(bot)
+    await dp.start_polling(bot, tasks_concurrency_limit=MAX_CONCURRENT_UPDATES)
 
 if __name__ == "__main__":
     print("Started UserBot")
@@ -1,9 +1,20 @@
+import csv
+import datetime
+from io import BytesIO, TextIOWrapper
+
 import openpyxl
 
-def export_report_to_excel(report, filename="report.xlsx"):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Orders Report"
+def export_report_to_excel(report, priced_report=None):
+    """
+    Build the order report as an .xlsx file in memory and return its bytes.
+    Uses a write-only workbook so rows are streamed instead of kept as cells.
+
+    report: rows of (item name, quantity, total price) from db.get_report
+    priced_report: optional db.get_cart_report_with_prices data, adds the
+    "By User" breakdown and the "Invoice" sheets
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Orders Report")
     
     # Header
     ws.append(["Item", "Quantity", "Total Price"])
@@ -11,7 +22,162 @@ def export_report_to_excel(report, filename="report.xlsx"):
     # Rows
     for name, total, total_price in report:
         ws.append([name, total, total_price])
+
+    if priced_report:
+        # جزئیات هر کاربر
+        ws = wb.create_sheet("By User")
+        ws.append(["User", "Item", "Quantity", "Total Price"])
+        names = priced_report["names"]
+        for user_id, items in priced_report["users"].items():
+            for item_name, data in items.items():
+                ws.append([names.get(user_id) or f"#{user_id}", item_name, data["quantity"], data["total_price"]])
+
+        # فاکتور
+        ws = wb.create_sheet("Invoice")
+        ws.append(["User", "Total"])
+        for user_id, total in priced_report["user_totals"].items():
+            ws.append([names.get(user_id) or f"#{user_id}", total])
+        ws.append([])
+        ws.append(["Grand Total", priced_report["grand_total"]])
     
     # Save
-    wb.save(filename)
-    return filename
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+# ------------------------------
+# Menu import
+# ------------------------------
+# ارقام فارسی و عربی هم پذیرفته می‌شوند
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+_SEPARATORS = ("\t", " - ", " – ", "-", "–")
+
+
+def parse_price(value):
+    """
+    Price as a positive int: accepts 12000, "12,000", "۱۲۰۰۰" or 12000.0;
+    raises ValueError otherwise.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value != int(value):
+            raise ValueError("price must be a whole number")
+        price = int(value)
+    else:
+        text = str(value or "").translate(_DIGITS).replace(",", "").replace("٬", "").replace(" ", "")
+        if not text.isdigit():
+            raise ValueError("price must be a number")
+        price = int(text)
+    if price <= 0:
+        raise ValueError("price must be positive")
+    return price
+
+
+def _collect(rows):
+    """
+    rows: (row number, name, price, raw) -> (items, errors)
+    items: [(name, price)]; errors: [(row number, raw text, reason)]
+    """
+    items, errors = [], []
+    for number, name, price, raw in rows:
+        name = str(name or "").strip()
+        if not name and price in (None, ""):
+            continue
+        if not name:
+            errors.append((number, raw, "name is empty"))
+            continue
+        try:
+            items.append((name, parse_price(price)))
+        except ValueError as e:
+            errors.append((number, raw, str(e)))
+    return items, errors
+
+
+def parse_menu_text(text):
+    """
+    One "name - price" per line (a tab works too, for cells pasted from a sheet).
+    """
+    def rows():
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            for separator in _SEPARATORS:
+                name, sep, price = line.rpartition(separator)
+                if sep:
+                    break
+            else:
+                name, price = line, None
+            yield number, name, price, line
+    return _collect(rows())
+
+
+def parse_menu_csv(data):
+    """
+    First two columns are name and price; a header row is skipped.
+    """
+    def rows():
+        reader = csv.reader(TextIOWrapper(BytesIO(data), encoding="utf-8-sig", newline=""))
+        for number, row in enumerate(reader, 1):
+            if number == 1 and row and _is_header(row):
+                continue
+            row = (row + [None, None])[:2]
+            yield number, row[0], row[1], ",".join(str(v) for v in row if v is not None)
+    return _collect(rows())
+
+
+def parse_menu_xlsx(data):
+    """
+    Same layout as the CSV, first sheet only; read-only mode streams the rows.
+    """
+    wb = openpyxl.load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        def rows():
+            for number, row in enumerate(wb.worksheets[0].iter_rows(max_col=2, values_only=True), 1):
+                row = (tuple(row) + (None, None))[:2]
+                if number == 1 and _is_header(row):
+                    continue
+                yield number, row[0], row[1], " | ".join("" if v is None else str(v) for v in row)
+        return _collect(rows())
+    finally:
+        wb.close()
+
+
+_NAME_LABELS = {"name", "item", "items", "title", "food", "menu", "نام", "غذا", "آیتم"}
+
+
+def _is_header(row):
+    """
+    A first row is a header only when it looks like one: a known label in the
+    name column and text without digits in the price column. Anything else is
+    data, so a first item with a bad price is reported, not skipped.
+    """
+    name = str(row[0] or "").strip().lower() if row else ""
+    price = row[1] if len(row) > 1 else None
+    if name not in _NAME_LABELS or not isinstance(price, str):
+        return False
+    price = price.translate(_DIGITS).strip()
+    return bool(price) and not any(c.isdigit() for c in price)
+
+
+# ------------------------------
+# Order cutoff
+# ------------------------------
+def parse_cutoff(text, now=None):
+    """
+    Unix time of a cutoff given as "+90" (minutes from now) or "18:30"
+    (server local time, tomorrow if that time has passed today);
+    raises ValueError otherwise.
+    """
+    now = now or datetime.datetime.now()
+    text = text.strip().translate(_DIGITS)
+    if text.startswith("+"):
+        if not text[1:].isdigit() or int(text[1:]) <= 0:
+            raise ValueError("minutes must be a positive number")
+        return (now + datetime.timedelta(minutes=int(text[1:]))).timestamp()
+
+    hour, _, minute = text.partition(":")
+    if not (hour.isdigit() and minute.isdigit()):
+        raise ValueError("expected HH:MM or +minutes")
+    cutoff = now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+    if cutoff <= now:
+        cutoff += datetime.timedelta(days=1)
+    return cutoff.timestamp()
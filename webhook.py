@@ -0,0 +1,74 @@
+"""
+Webhook serving mode: both dispatchers on one aiohttp application,
+each on its own path with its own secret token.
+"""
+import asyncio
+import signal
+
+from aiogram import BaseMiddleware
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import MAX_CONCURRENT_UPDATES, WEBHOOK_BASE_URL, WEBHOOK_HOST, WEBHOOK_PORT
+
+
+class ConcurrencyLimit(BaseMiddleware):
+    """
+    Outer update middleware bounding how many updates are processed at once.
+    """
+
+    def __init__(self, limit=MAX_CONCURRENT_UPDATES):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(self, handler, event, data):
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+def build_app(bots):
+    """
+    bots: iterable of (dispatcher, bot, path, secret_token)
+    """
+    app = web.Application()
+    limit = ConcurrencyLimit()
+
+    for dp, bot, path, secret in bots:
+        dp.update.outer_middleware(limit)
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+        setup_application(app, dp, bot=bot)
+        app.on_startup.append(_set_webhook(dp, bot, path, secret))
+        app.on_shutdown.append(_close_session(bot))
+    return app
+
+
+def _set_webhook(dp, bot, path, secret):
+    async def on_startup(app):
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                WEBHOOK_BASE_URL.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+    return on_startup
+
+
+def _close_session(bot):
+    async def on_shutdown(app):
+        await bot.session.close()
+    return on_shutdown
+
+
+async def serve(bots, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    runner = web.AppRunner(build_app(bots))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()